@@ -6,13 +6,39 @@ from tox.execute.api import ExecuteInstance, ExecuteOptions, ExecuteStatus
 from tox.execute.request import ExecuteRequest
 from tox.execute.stream import SyncWrite
 
+import tox_conda.conda
+import tox_conda.repodata
 from tox_conda.plugin import CondaEnvRunner
 
 pytest_plugins = "tox.pytest"
 
 
+@pytest.fixture(autouse=True)
+def tox_conda_cache_dir(tmp_path, monkeypatch):
+    """Keep the caches shared between tox invocations inside the test's directory."""
+    path = tmp_path / "tox-conda-cache"
+    monkeypatch.setenv("TOX_CONDA_CACHE_DIR", str(path))
+    # every test is a new tox session
+    monkeypatch.setattr(tox_conda.repodata, "_REFRESHED", {})
+    # and resolves the conda frontend, whose version the tests patch, again
+    tox_conda.conda._clear_conda_frontends()
+    return path
+
+
+@pytest.fixture
+def mock_conda_outputs():
+    """Standard output returned by mocked commands, keyed by their run id."""
+    return {}
+
+
+@pytest.fixture
+def mock_conda_errors():
+    """Standard error of mocked commands that fail, keyed by their run id."""
+    return {}
+
+
 @pytest.fixture
-def mock_conda_env_runner(request, monkeypatch):
+def mock_conda_env_runner(request, monkeypatch, mock_conda_outputs, mock_conda_errors):
     class MockExecuteStatus(ExecuteStatus):
         def __init__(
             self,
@@ -50,6 +76,13 @@ def mock_conda_env_runner(request, monkeypatch):
             self.exit_code = exit_code
 
         def __enter__(self) -> ExecuteStatus:
+            output = mock_conda_outputs.get(self.request.run_id)
+            if output:
+                self._out.handler(output.encode())
+            error = mock_conda_errors.get(self.request.run_id)
+            if error:
+                self._err.handler(error.encode())
+                return MockExecuteStatus(self.options, self._out, self._err, 1)
             return MockExecuteStatus(self.options, self._out, self._err, self.exit_code)
 
         def __exit__(
@@ -2,6 +2,8 @@
 
 from fnmatch import fnmatch
 
+import tox_conda.conda
+
 
 def assert_create_command(cmd):
     assert fnmatch(cmd, "*conda create*") or fnmatch(cmd, "*conda env create*")
@@ -37,18 +39,20 @@ def test_conda_no_recreate(tox_project, mock_conda_env_runner):
         outcome.assert_success()
 
     executed_shell_commands = mock_conda_env_runner
-    # get_python, create env, install deps, get_python, and nothing else because no changes
-    assert len(executed_shell_commands) == 4
+    # get_python, create env, install deps, and nothing else because no changes and the
+    # base interpreter probe is cached
+    assert len(executed_shell_commands) == 3
     assert_create_command(executed_shell_commands[1])
     assert_install_command(executed_shell_commands[2])
 
 
-def test_conda_recreate_by_dependency_change(tox_project, mock_conda_env_runner):
+def test_conda_update_by_dependency_change(tox_project, mock_conda_env_runner):
     ini = """
         [testenv:py123]
         skip_install = True
         conda_deps =
             asdf
+            numpy>=1.25
     """
     ini_modified = """
         [testenv:py123]
@@ -56,6 +60,13 @@ def test_conda_recreate_by_dependency_change(tox_project, mock_conda_env_runner)
         conda_deps =
             asdf
             black
+            numpy>=1.26
+    """
+    ini_removed = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            numpy>=1.26
     """
     outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
     outcome.assert_success()
@@ -63,14 +74,139 @@ def test_conda_recreate_by_dependency_change(tox_project, mock_conda_env_runner)
     outcome = tox_project({"tox.ini": ini_modified}).run("-e", "py123")
     outcome.assert_success()
 
+    outcome = tox_project({"tox.ini": ini_removed}).run("-e", "py123")
+    outcome.assert_success()
+
     executed_shell_commands = mock_conda_env_runner
-    # get_python, create env, install deps, get_python, create env, install deps
+    # get_python, create env, install deps, install added deps, recreate env, install deps
     assert len(executed_shell_commands) == 6
 
     assert_create_command(executed_shell_commands[1])
     assert_install_command(executed_shell_commands[2])
+    # added and bumped dependencies are installed in place
+    assert_install_command(executed_shell_commands[3])
+    assert executed_shell_commands[3].endswith(" black 'numpy>=1.26'")
+    assert "python=" in executed_shell_commands[3]
+    # dropping dependencies recreates the environment
     assert_create_command(executed_shell_commands[4])
-    assert_install_command(executed_shell_commands[5])
+    assert executed_shell_commands[5].endswith(" 'numpy>=1.26'")
+    assert not any(" remove " in cmd for cmd in executed_shell_commands)
+
+
+def test_conda_recreate_by_dropped_dependency(tox_project, mock_conda_env_runner):
+    ini = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            numpy
+            scipy
+    """
+    # scipy depends on numpy, `conda remove numpy` would remove scipy as well
+    ini_removed = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            scipy
+    """
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_success()
+
+    outcome = tox_project({"tox.ini": ini_removed}).run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps, recreate env, install deps
+    assert len(executed_shell_commands) == 5
+    assert_create_command(executed_shell_commands[3])
+    assert executed_shell_commands[4].endswith(" scipy")
+
+
+def test_conda_no_recreate_by_cosmetic_change(tox_project, mock_conda_env_runner):
+    ini = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            numpy>=1.20,<2
+            Black
+        conda_channels =
+            conda-forge
+    """
+    ini_modified = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            black
+            numpy >= 1.20 , < 2
+        conda_channels =
+            conda-forge
+            conda-forge
+    """
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    proj = tox_project({"tox.ini": ini_modified})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps
+    assert len(executed_shell_commands) == 3
+
+
+def test_conda_recreate_by_channel_change(tox_project, mock_conda_env_runner):
+    ini = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            asdf
+    """
+    ini_modified = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            asdf
+            black
+        conda_channels =
+            conda-forge
+    """
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_success()
+
+    outcome = tox_project({"tox.ini": ini_modified}).run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps, create env, install deps
+    assert len(executed_shell_commands) == 5
+
+    assert_create_command(executed_shell_commands[1])
+    assert_install_command(executed_shell_commands[2])
+    assert_create_command(executed_shell_commands[3])
+    assert_install_command(executed_shell_commands[4])
+
+
+def test_conda_recreate_by_solver_change(tox_project, mock_conda_env_runner):
+    ini = """
+        [testenv:py123]
+        skip_install = True
+        conda_deps =
+            black
+    """
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    ini = ini.replace("conda_deps", "conda_solver = classic\n        conda_deps")
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps, create env, install deps
+    assert len(executed_shell_commands) == 5
+    assert_create_command(executed_shell_commands[3])
+    assert " --solver=classic" in executed_shell_commands[3]
 
 
 def test_conda_recreate_by_env_file_path_change(tox_project, mock_conda_env_runner):
@@ -107,11 +243,11 @@ def test_conda_recreate_by_env_file_path_change(tox_project, mock_conda_env_runn
     outcome.assert_success()
 
     executed_shell_commands = mock_conda_env_runner
-    # get_python, create env, get_python, create env
-    assert len(executed_shell_commands) == 4
+    # get_python, create env, create env
+    assert len(executed_shell_commands) == 3
 
     assert_create_command(executed_shell_commands[1])
-    assert_create_command(executed_shell_commands[3])
+    assert_create_command(executed_shell_commands[2])
 
 
 def test_conda_recreate_by_env_file_content_change(tox_project, mock_conda_env_runner):
@@ -151,11 +287,41 @@ def test_conda_recreate_by_env_file_content_change(tox_project, mock_conda_env_r
     outcome.assert_success()
 
     executed_shell_commands = mock_conda_env_runner
-    # get_python, create env, get_python, create env
-    assert len(executed_shell_commands) == 4
+    # get_python, create env, create env
+    assert len(executed_shell_commands) == 3
 
     assert_create_command(executed_shell_commands[1])
-    assert_create_command(executed_shell_commands[3])
+    assert_create_command(executed_shell_commands[2])
+
+
+def test_conda_recreate_by_referenced_file_change(tox_project, mock_conda_env_runner):
+    ini = """
+        [testenv:py123]
+        skip_install = True
+        conda_env = conda-env.yml
+    """
+    yaml = """
+         name: tox-conda
+         dependencies:
+           - numpy
+           - pip:
+             - -r requirements.txt
+        """
+    proj = tox_project({"tox.ini": ini, "requirements.txt": "pytest"})
+    (proj.path / "conda-env.yml").write_text(yaml)
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    (proj.path / "requirements.txt").write_text("pytest>=8")
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, create env
+    assert len(executed_shell_commands) == 3
+
+    assert_create_command(executed_shell_commands[1])
+    assert_create_command(executed_shell_commands[2])
 
 
 def test_conda_recreate_by_spec_file_path_change(tox_project, mock_conda_env_runner):
@@ -180,13 +346,13 @@ def test_conda_recreate_by_spec_file_path_change(tox_project, mock_conda_env_run
     outcome.assert_success()
 
     executed_shell_commands = mock_conda_env_runner
-    # get_python, create env, install deps, get_python, create env, install deps
-    assert len(executed_shell_commands) == 6
+    # get_python, create env, install deps, create env, install deps
+    assert len(executed_shell_commands) == 5
 
     assert_create_command(executed_shell_commands[1])
     assert_install_command(executed_shell_commands[2])
-    assert_create_command(executed_shell_commands[4])
-    assert_install_command(executed_shell_commands[5])
+    assert_create_command(executed_shell_commands[3])
+    assert_install_command(executed_shell_commands[4])
 
 
 def test_conda_recreate_by_spec_file_content_change(tox_project, mock_conda_env_runner):
@@ -213,10 +379,31 @@ def test_conda_recreate_by_spec_file_content_change(tox_project, mock_conda_env_
     outcome.assert_success()
 
     executed_shell_commands = mock_conda_env_runner
-    # get_python, create env, install deps, get_python, create env, install deps
-    assert len(executed_shell_commands) == 6
+    # get_python, create env, install deps, create env, install deps
+    assert len(executed_shell_commands) == 5
 
     assert_create_command(executed_shell_commands[1])
     assert_install_command(executed_shell_commands[2])
-    assert_create_command(executed_shell_commands[4])
-    assert_install_command(executed_shell_commands[5])
+    assert_create_command(executed_shell_commands[3])
+    assert_install_command(executed_shell_commands[4])
+
+
+def test_conda_python_cache_hashes_files_once(tox_project, mock_conda_env_runner, mocker):
+    ini = """
+        [testenv:py123]
+        skip_install = True
+        conda_spec = conda-spec.txt
+        commands_pre = python --version
+        commands = pytest
+        commands_post = black
+    """
+    proj = tox_project({"tox.ini": ini, "conda-spec.txt": "numpy\n-r requirements.txt"})
+    hash_closure = mocker.spy(tox_conda.conda, "hash_closure")
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    # get_python, create env, install deps, python --version, pytest, black
+    assert len(mock_conda_env_runner) == 6
+    assert hash_closure.call_count == 1
+    # the referenced file is watched too, although it does not exist
+    assert hash_closure.call_args.args[1][-1] == proj.path / "requirements.txt"
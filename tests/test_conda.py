@@ -1,3 +1,5 @@
+import json
+import sys
 from fnmatch import fnmatch
 
 import pytest
@@ -39,7 +41,7 @@ def test_missing_conda(tox_project, mocker):
     skip_install = True
     runner = conda
     """
-    mocker.patch("tox_conda.conda.find_conda", side_effect=Fail("not found"))
+    mocker.patch("tox_conda.conda.find_conda_frontend", side_effect=Fail("not found"))
     outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
     outcome.assert_failed()
 
@@ -74,3 +76,168 @@ def test_conda_runner_overload(tox_project, mock_conda_env_runner):
     executed_shell_commands = mock_conda_env_runner
     # No conda commands should be run because virtualenv is used.
     assert len(executed_shell_commands) == 0
+
+
+def test_conda_direct_executor(tox_project, mock_conda_env_runner, mock_conda_outputs):
+    """Check that the direct executor activates the env once and reuses it across runs."""
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_executor = direct
+    commands_pre = python --version
+    commands = pytest
+    """
+    proj = tox_project({"tox.ini": ini})
+    env_dir = proj.path / ".tox" / "py123"
+    activated = {"PATH": str(env_dir / "bin"), "CONDA_PREFIX": str(env_dir)}
+    mock_conda_outputs["activation_env"] = json.dumps(activated)
+    mock_conda_outputs["_ensure_python_env_exists"] = json.dumps({"envs": [str(env_dir)]})
+
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, activation probe, python --version, pytest
+    assert len(executed_shell_commands) == 5
+    assert_conda_context(proj, "py123", executed_shell_commands[2], "python -c *")
+    assert executed_shell_commands[3] == "python --version"
+    assert executed_shell_commands[4] == "pytest"
+
+    cache = json.loads((env_dir / ".tox-conda.json").read_text())
+    assert cache["activation"]["path"] == [str(env_dir / "bin")]
+    assert cache["activation"]["env"]["CONDA_PREFIX"] == str(env_dir)
+
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+    # python --version, pytest: the activation is read from disk
+    assert executed_shell_commands[5:] == ["python --version", "pytest"]
+
+    # a conda transaction in the environment invalidates the persisted activation
+    (env_dir / "conda-meta").mkdir()
+    (env_dir / "conda-meta" / "history").write_text("==> 2024-01-01 00:00:00 <==")
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+    # env list, activation probe, python --version, pytest
+    assert len(executed_shell_commands) == 11
+    assert_conda_context(proj, "py123", executed_shell_commands[8], "python -c *")
+
+
+def test_conda_invalid_executor(tox_project, mock_conda_env_runner):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_executor = magic
+    commands = pytest
+    """
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_failed()
+    assert "Invalid conda_executor value 'magic'" in outcome.out
+
+
+def test_conda_interpreter_single_probe(tox_project, mock_conda_env_runner, mock_conda_outputs):
+    """Check that all interpreter paths come from one persisted probe."""
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    commands = echo {env_python} {env_bin_dir} {env_site_packages_dir}
+    """
+    proj = tox_project({"tox.ini": ini})
+    env_dir = proj.path / ".tox" / "py123"
+    interpreter = {
+        "executable": str(env_dir / "bin" / "python"),
+        "prefix": str(env_dir),
+        "scripts": str(env_dir / "bin"),
+        "purelib": str(env_dir / "lib" / "site-packages"),
+        "platlib": str(env_dir / "lib" / "site-packages"),
+        "version_info": [3, 12, 3, "final", 0],
+    }
+    mock_conda_outputs["env_interpreter"] = json.dumps(interpreter)
+
+    for _ in range(2):
+        outcome = proj.run("-e", "py123")
+        outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, interpreter probe, echo, echo
+    assert len(executed_shell_commands) == 5
+    assert_conda_context(proj, "py123", executed_shell_commands[2], "python -c *")
+    bin_dir, site_packages = env_dir / "bin", env_dir / "lib" / "site-packages"
+    expected = f"echo {bin_dir / 'python'} {bin_dir} {site_packages}"
+    assert executed_shell_commands[3].endswith(expected)
+    assert executed_shell_commands[4].endswith(expected)
+
+
+def test_get_python_cached_across_envs(tox_project, mock_conda_env_runner, tox_conda_cache_dir):
+    """Check that environments sharing a base interpreter probe it only once."""
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    [testenv:py124]
+    skip_install = True
+    """
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123,py124")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, create env
+    assert len(executed_shell_commands) == 3
+    assert "conda create" not in executed_shell_commands[0]
+
+    cached = json.loads((tox_conda_cache_dir / "python.json").read_text())
+    assert len(cached) == 1
+    (entry,) = cached.values()
+    assert entry["info"]["version_info"][:2] == list(sys.version_info[:2])
+    entry["fingerprint"] = [0, 0, 0]
+    (tox_conda_cache_dir / "python.json").write_text(json.dumps(cached))
+
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+    # a changed interpreter fingerprint triggers a new probe
+    assert len(executed_shell_commands) == 4
+
+
+def test_conda_env_exists_fast_path(tox_project, mock_conda_env_runner, mock_conda_outputs):
+    """Check that an existing env is recognized from conda-meta without `conda env list`."""
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    commands = echo {env_python}
+    """
+    proj = tox_project({"tox.ini": ini})
+    env_dir = proj.path / ".tox" / "py123"
+    interpreter = {
+        "executable": str(env_dir / "bin" / "python"),
+        "prefix": str(env_dir),
+        "scripts": str(env_dir / "bin"),
+        "purelib": str(env_dir / "lib" / "site-packages"),
+        "platlib": str(env_dir / "lib" / "site-packages"),
+        "version_info": [3, 12, 3, "final", 0],
+    }
+    mock_conda_outputs["env_interpreter"] = json.dumps(interpreter)
+    mock_conda_outputs["_ensure_python_env_exists"] = json.dumps({"envs": [str(env_dir)]})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, interpreter probe, echo
+    assert len(executed_shell_commands) == 4
+
+    # the environment changed, so the interpreter is probed again in the next run
+    (env_dir / "conda-meta").mkdir()
+    (env_dir / "conda-meta" / "history").write_text("==> 2024-01-01 00:00:00 <==")
+    (env_dir / "conda-meta" / "python-3.12.3-0.json").write_text("{}")
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+    # interpreter probe, echo: no `conda env list`
+    assert len(executed_shell_commands) == 6
+    assert not any("env list" in cmd for cmd in executed_shell_commands)
+
+    # without package records the on-disk check is ambiguous and conda is asked
+    (env_dir / "conda-meta" / "python-3.12.3-0.json").unlink()
+    with (env_dir / "conda-meta" / "history").open("a") as history:
+        history.write("\n==> 2024-01-02 00:00:00 <==")
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+    assert "env list --json" in executed_shell_commands[6]
+    assert len(executed_shell_commands) == 9
@@ -1,10 +1,21 @@
 """Conda environment creation and installation tests."""
 
+import hashlib
+import json
+import os
 import pathlib
+import subprocess
+import sys
 from fnmatch import fnmatch
 
 from ruamel.yaml import YAML
 
+import tox_conda.conda
+import tox_conda.repodata
+import tox_conda.timing
+from tox_conda.backend import MicromambaBackend
+from tox_conda.conda import CondaFrontend
+
 
 def test_conda_create(tox_project, mock_conda_env_runner):
     ini = """
@@ -343,3 +354,463 @@ def test_conda_create_args(tox_project, mock_conda_env_runner):
     create_cmd = executed_shell_commands[1]
     assert fnmatch(create_cmd, "*conda create*")
     assert "--override-channels" in create_cmd
+
+
+def test_conda_solve_once(tox_project, mock_conda_env_runner):
+    env_name = "py123"
+    ini = f"""
+        [testenv:{env_name}]
+        skip_install = True
+        conda_solve_once = True
+        conda_deps =
+            numpy
+            astropy
+        conda_channels =
+            conda-forge
+        conda_install_args =
+            --override-channels
+        conda_spec = conda_spec.txt
+    """
+    proj = tox_project({"tox.ini": ini})
+    (proj.path / "conda_spec.txt").touch()
+
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python and a single create, no install
+    assert len(executed_shell_commands) == 2
+    assert fnmatch(
+        executed_shell_commands[1],
+        f"*conda create -p {str(proj.path / '.tox' / env_name)} python=* --yes --quiet"
+        " --channel conda-forge --override-channels astropy numpy --file=conda_spec.txt",
+    )
+
+
+def test_conda_lock(tox_project, mock_conda_env_runner, mock_conda_outputs, tox_conda_cache_dir):
+    env_name = "py123"
+    ini = f"""
+        [testenv:{env_name}]
+        skip_install = True
+        conda_lock = True
+        conda_deps =
+            numpy
+    """
+    explicit = "@EXPLICIT\nhttps://conda.anaconda.org/conda-forge/noarch/numpy-1.0-0.conda#abc"
+    mock_conda_outputs["create_python_env-lock"] = explicit
+    proj = tox_project({"tox.ini": ini})
+    env_dir = str(proj.path / ".tox" / env_name)
+
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps, capture lock
+    assert len(executed_shell_commands) == 4
+    assert fnmatch(executed_shell_commands[3], f"*conda list -p {env_dir} --explicit --md5")
+    (lock,) = (tox_conda_cache_dir / "explicit").iterdir()
+    assert lock.read_text() == explicit + "\n"
+
+    # recreating the unchanged environment skips the solver
+    outcome = proj.run("-r", "-e", "py123")
+    outcome.assert_success()
+    assert len(executed_shell_commands) == 5
+    assert fnmatch(
+        executed_shell_commands[4], f"*conda create -p {env_dir} --file {lock} --yes --quiet"
+    )
+
+
+def test_conda_store(tox_project, mock_conda_env_runner, tox_conda_cache_dir):
+    ini = """
+        [testenv]
+        skip_install = True
+        conda_store = True
+        conda_deps =
+            numpy
+        [testenv:py123]
+        [testenv:py124]
+    """
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps, save template
+    assert len(executed_shell_commands) == 4
+    (marker,) = (tox_conda_cache_dir / "envs").glob("*.json")
+    template = marker.with_suffix("")
+    env_dir = proj.path / ".tox" / "py123"
+    assert fnmatch(
+        executed_shell_commands[3],
+        f"*conda create -p {template} --clone {env_dir} --yes --quiet --offline",
+    )
+    template.mkdir()
+
+    # another environment with the same conda settings is cloned from the template
+    outcome = proj.run("-e", "py124")
+    outcome.assert_success()
+    assert len(executed_shell_commands) == 5
+    env_dir = proj.path / ".tox" / "py124"
+    assert fnmatch(
+        executed_shell_commands[4],
+        f"*conda create -p {env_dir} --clone {template} --yes --quiet --offline",
+    )
+
+
+def test_conda_store_budget(tox_project, mock_conda_env_runner, tox_conda_cache_dir):
+    ini = """
+        [tox]
+        conda_store_budget = 0
+        [testenv:py123]
+        skip_install = True
+        conda_lock = True
+    """
+    stale_lock = tox_conda_cache_dir / "explicit" / "stale.txt"
+    stale_lock.parent.mkdir(parents=True)
+    stale_lock.write_text("@EXPLICIT\n")
+
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_success()
+
+    # the store is trimmed to the budget before the new lock would be added
+    assert not stale_lock.exists()
+
+
+def test_conda_store_budget_checked_at_start(
+    tox_project, mock_conda_env_runner, tox_conda_cache_dir
+):
+    ini = """
+        [tox]
+        conda_store_budget = 0
+        [testenv:py123]
+        skip_install = True
+    """
+    stale_lock = tox_conda_cache_dir / "explicit" / "stale.txt"
+    stale_lock.parent.mkdir(parents=True)
+    stale_lock.write_text("@EXPLICIT\n")
+
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_success()
+
+    # nothing is added to the store, the budget is checked when the run starts
+    assert not stale_lock.exists()
+
+
+def test_conda_micromamba_backend(tmp_path, tox_project, mock_conda_env_runner, monkeypatch):
+    micromamba = tmp_path / "bin" / "micromamba"
+    micromamba.parent.mkdir()
+    micromamba.write_text("")
+    monkeypatch.setenv("MAMBA_EXE", str(micromamba))
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_backend = micromamba
+    conda_root_prefix = /opt/mamba
+    conda_deps =
+        black
+    commands = pytest
+    """
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    env_dir = str(proj.path / ".tox" / "py123")
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps, pytest
+    assert len(executed_shell_commands) == 4
+    assert executed_shell_commands[1].startswith(
+        f"{micromamba} create --root-prefix /opt/mamba -p {env_dir} python="
+    )
+    assert executed_shell_commands[2].startswith(
+        f"{micromamba} install --root-prefix /opt/mamba --quiet --yes -p {env_dir}"
+    )
+    assert executed_shell_commands[3] == (
+        f"{micromamba} run --root-prefix /opt/mamba -p {env_dir} pytest"
+    )
+
+
+def test_conda_micromamba_env_offline(tmp_path, tox_project, mock_conda_env_runner, monkeypatch):
+    micromamba = tmp_path / "bin" / "micromamba"
+    micromamba.parent.mkdir()
+    micromamba.write_text("")
+    monkeypatch.setenv("MAMBA_EXE", str(micromamba))
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_backend = micromamba
+    conda_env = conda-env.yml
+    """
+    proj = tox_project({"tox.ini": ini})
+    (proj.path / "conda-env.yml").write_text("dependencies:\n  - numpy\n")
+    outcome = proj.run("-e", "py123", "--conda-offline")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env from the environment file
+    assert len(executed_shell_commands) == 2
+    assert fnmatch(
+        executed_shell_commands[1], f"{micromamba} create -p * --file * --yes --quiet --offline"
+    )
+
+
+def test_micromamba_pkgs_dirs(tmp_path, monkeypatch):
+    monkeypatch.delenv("CONDA_PKGS_DIRS", raising=False)
+    monkeypatch.delenv("MAMBA_ROOT_PREFIX", raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    frontend = CondaFrontend(tmp_path / "bin" / "micromamba")
+
+    # micromamba's default root prefix, unless one is configured
+    assert MicromambaBackend(frontend).pkgs_dirs() == [tmp_path / "micromamba" / "pkgs"]
+    monkeypatch.setenv("MAMBA_ROOT_PREFIX", str(tmp_path / "mamba"))
+    assert MicromambaBackend(frontend).pkgs_dirs() == [tmp_path / "mamba" / "pkgs"]
+    root_prefix = pathlib.Path("/opt/mamba")
+    assert MicromambaBackend(frontend, str(root_prefix)).pkgs_dirs() == [root_prefix / "pkgs"]
+
+
+def test_conda_invalid_backend(tox_project, mock_conda_env_runner):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_backend = pixi
+    """
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_failed()
+    assert "Invalid conda_backend value 'pixi'" in outcome.out
+
+
+def test_conda_solver(tox_project, mock_conda_env_runner, mocker):
+    mocker.patch.object(CondaFrontend, "version", "23.11.0")
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_solver = libmamba
+    conda_deps =
+        black
+    """
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps
+    assert len(executed_shell_commands) == 3
+    assert fnmatch(executed_shell_commands[1], "*conda create * --solver=libmamba*")
+    assert fnmatch(executed_shell_commands[2], "*conda install * --solver=libmamba *")
+
+
+def test_conda_solver_unsupported(tox_project, mock_conda_env_runner, mocker):
+    mocker.patch.object(CondaFrontend, "version", "4.12.0")
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_solver = libmamba
+    """
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_failed()
+    assert "conda_solver requires conda>=22.11" in outcome.out
+    # only get_python ran
+    assert len(mock_conda_env_runner) == 1
+
+
+def test_conda_offline(tox_project, mock_conda_env_runner, mock_conda_errors):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_deps =
+        numpy>=1.99
+    """
+    mock_conda_errors["create_python_env-install"] = (
+        "PackagesNotFoundError: The following packages are not available from current channels:"
+        "\n\n  - numpy[version='>=1.99']\n\nCurrent channels:\n\n  - defaults\n"
+    )
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123", "--conda-offline")
+    outcome.assert_failed()
+    assert "the package cache is missing:\n  - numpy[version='>=1.99']" in outcome.out
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, create env, install deps
+    assert len(executed_shell_commands) == 3
+    assert executed_shell_commands[1].endswith(" --yes --quiet --offline")
+    assert fnmatch(executed_shell_commands[2], "*conda install --quiet --yes -p * --offline *")
+
+
+def test_conda_offline_lock(
+    tmp_path, tox_project, mock_conda_env_runner, mock_conda_outputs, monkeypatch
+):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_offline = true
+    conda_lock = true
+    """
+    pkgs_dir = tmp_path / "pkgs"
+    (pkgs_dir / "python-3.12.3-h1_0").mkdir(parents=True)
+    mock_conda_outputs["create_python_env-lock"] = (
+        "@EXPLICIT\n"
+        "https://conda.anaconda.org/conda-forge/linux-64/python-3.12.3-h1_0.conda#abc\n"
+        "https://conda.anaconda.org/conda-forge/noarch/pip-24.0-pyhd8ed1ab_0.conda#def\n"
+    )
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123")
+    outcome.assert_success()
+
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(pkgs_dir))
+    outcome = proj.run("-e", "py123", "-r")
+    outcome.assert_failed()
+    assert "the package cache is missing:\n  - pip-24.0-pyhd8ed1ab_0" in outcome.out
+    # the environment is neither solved nor created from the lock file
+    assert not any("--file" in cmd for cmd in mock_conda_env_runner)
+
+
+def test_conda_download_workers(
+    tmp_path, tox_project, mock_conda_env_runner, mock_conda_outputs, monkeypatch
+):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_download_workers = 4
+    conda_deps =
+        numpy
+    """
+    package = tmp_path / "channel" / "numpy-1.0-0.conda"
+    package.parent.mkdir()
+    package.write_bytes(b"numpy")
+    record = {"url": package.as_uri(), "md5": hashlib.md5(b"numpy").hexdigest()}
+    mock_conda_outputs["conda_prefetch-solve"] = json.dumps({"actions": {"FETCH": [record]}})
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(tmp_path / "pkgs"))
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123")
+    outcome.assert_success()
+
+    executed_shell_commands = mock_conda_env_runner
+    # get_python, solve, create env, install deps
+    assert len(executed_shell_commands) == 4
+    assert executed_shell_commands[1].endswith(" --dry-run --json")
+    assert (tmp_path / "pkgs" / "numpy-1.0-0.conda").read_bytes() == b"numpy"
+
+
+def test_conda_repodata_refreshed_once(tmp_path, tox_project, mock_conda_env_runner):
+    ini = """
+    [testenv]
+    skip_install = True
+    conda_deps =
+        numpy
+    [testenv:py123]
+    [testenv:py124]
+    """
+    result_json = tmp_path / "result.json"
+    proj = tox_project({"tox.ini": ini})
+    outcome = proj.run("-e", "py123,py124", "--result-json", str(result_json))
+    outcome.assert_success()
+
+    # create env, install deps, create env, install deps
+    transactions = [cmd for cmd in mock_conda_env_runner if fnmatch(cmd, "*conda [ci][rn]*")]
+    assert len(transactions) == 4
+    assert "--use-index-cache" not in transactions[0]
+    assert all("--use-index-cache" in cmd for cmd in transactions[1:])
+
+    testenvs = json.loads(result_json.read_text())["testenvs"]
+    assert testenvs["py123"]["conda_repodata"] == {"policy": "refresh", "ttl": 0}
+    assert testenvs["py124"]["conda_repodata"] == {"policy": "index-cache", "ttl": 0}
+
+
+def test_conda_repodata_ttl(tox_project, mock_conda_env_runner, monkeypatch):
+    ini = """
+    [tox]
+    conda_repodata_ttl = {}
+    [testenv:py123]
+    skip_install = True
+    """
+    for ttl, expected in ((0, False), (3600, True)):
+        proj = tox_project({"tox.ini": ini.format(ttl)})
+        outcome = proj.run("-e", "py123", "-r")
+        outcome.assert_success()
+        # a new tox run
+        monkeypatch.setattr(tox_conda.repodata, "_REFRESHED", {})
+        outcome = proj.run("-e", "py123", "-r")
+        outcome.assert_success()
+        assert ("--use-index-cache" in mock_conda_env_runner[-1]) is expected
+
+
+def test_command_report(tox_project, mock_conda_env_runner):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    commands = python -c 'print("tests")'
+    """
+    proj = tox_project({"tox.ini": ini})
+    proj.run("-e", "py123").assert_success()
+
+    report = json.loads((proj.path / ".tox" / ".tox-conda-report.json").read_text())
+    env_report = report["envs"]["py123"]
+    assert env_report["conda_repodata"]["policy"] == "refresh"
+    assert set(env_report["phases"]) == {"link", "commands"}
+    commands = {command["run_id"]: command for command in env_report["commands"]}
+    assert {"_get_python", "create_python_env-create", "commands[0]"} <= set(commands)
+
+    # the interpreter probe is not mocked, so its resource usage is known
+    probe = commands["_get_python"]
+    assert probe["argv"][1:3] == ["-c", tox_conda.conda.PYTHON_INFO_SCRIPT]
+    assert probe["exit_code"] == 0
+    assert probe["stdout_bytes"] > 0
+    if hasattr(os, "wait4"):
+        assert probe["cpu"] > 0
+        assert probe["max_rss"] > 0
+    assert commands["commands[0]"]["wall"] >= 0
+
+
+def test_command_report_unknown_popen():
+    class Popen(subprocess.Popen):
+        # private reaping hooks of another shape than the ones rusage tracking patches
+        def _internal_poll(self, *args, **kwargs):
+            return super()._internal_poll(*args, **kwargs)
+
+    holder = {}
+    with Popen([sys.executable, "-c", "pass"]) as process:
+        tox_conda.timing._track_rusage(process, holder)
+        assert process.wait() == 0
+    assert "_internal_poll" not in vars(process)
+    assert holder == {}
+
+
+def test_chrome_trace(tmp_path, tox_project, mock_conda_env_runner):
+    ini = """
+    [tox]
+    env_list = py123,py124
+    [testenv]
+    skip_install = True
+    commands = python -c 'print("tests")'
+    """
+    proj = tox_project({"tox.ini": ini})
+    trace_path = tmp_path / "trace.json"
+    proj.run("-e", "py123,py124", "--conda-trace", str(trace_path)).assert_success()
+
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    tracks = {e["args"]["name"]: e["tid"] for e in events if e["name"] == "thread_name"}
+    assert set(tracks) == {"py123", "py124"}
+    spans = [event for event in events if event["ph"] == "X"]
+    for name, tid in tracks.items():
+        categories = {event["cat"] for event in spans if event["tid"] == tid}
+        assert {"discovery", "link", "commands"} <= categories
+    assert all(event["ts"] >= 0 and event["dur"] >= 0 for event in spans)
+    create = next(event for event in spans if event["name"] == "create_python_env-create")
+    assert create["args"]["exit_code"] == 0
+
+
+def test_costs_recorded(tox_project, mock_conda_env_runner):
+    ini = """
+    [testenv:py123]
+    skip_install = True
+    conda_deps =
+        numpy
+    commands = python -c 'print("tests")'
+    """
+    proj = tox_project({"tox.ini": ini})
+    proj.run("-e", "py123").assert_success()
+    costs = json.loads((proj.path / ".tox" / ".tox-conda-costs.json").read_text())
+    assert set(costs["py123"]) == {"link", "commands"}
+
+    # a run that does not provision the environment keeps its provisioning costs
+    costs["py123"]["link"] = 100.0
+    (proj.path / ".tox" / ".tox-conda-costs.json").write_text(json.dumps(costs))
+    proj.run("-e", "py123").assert_success()
+    costs = json.loads((proj.path / ".tox" / ".tox-conda-costs.json").read_text())
+    assert costs["py123"]["link"] == 100.0
@@ -0,0 +1,98 @@
+"""Tests for the parallel package downloader, against local channels."""
+
+import hashlib
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from tox.tox_env.errors import Fail
+
+from tox_conda.download import download_packages
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves a directory like a conda channel, honouring `Range: bytes=N-` requests."""
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("Range")))
+        range_header = self.headers.get("Range")
+        if range_header is None:
+            return super().do_GET()
+        content = (Path(self.directory) / self.path.lstrip("/")).read_bytes()
+        offset = int(range_header[len("bytes=") : -1])
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(content) - offset))
+        self.end_headers()
+        self.wfile.write(content[offset:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def channel(tmp_path):
+    path = tmp_path / "channel"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def http_channel(channel):
+    RangeRequestHandler.requests = []
+    handler = partial(RangeRequestHandler, directory=str(channel))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def add_package(channel, name, url=None):
+    content = name.encode() * 10000
+    (channel / name).write_bytes(content)
+    url = f"{url}/{name}" if url else (channel / name).as_uri()
+    return {"url": url, "sha256": hashlib.sha256(content).hexdigest()}
+
+
+def test_download_file_channel(tmp_path, channel):
+    records = [add_package(channel, f"pkg{index}-1.0-0.conda") for index in range(5)]
+    pkgs_dir = tmp_path / "pkgs"
+    assert download_packages(records, pkgs_dir, workers=3) == 5
+    for record in records:
+        name = record["url"].rsplit("/", 1)[-1]
+        assert (pkgs_dir / name).read_bytes() == (channel / name).read_bytes()
+    assert (pkgs_dir / "urls.txt").read_text().splitlines() == [r["url"] for r in records]
+
+    # cached packages are verified, not downloaded again
+    assert download_packages(records, pkgs_dir, workers=3) == 0
+
+
+def test_download_checksum_mismatch(tmp_path, channel):
+    record = add_package(channel, "numpy-1.0-0.conda")
+    record["sha256"] = "0" * 64
+    with pytest.raises(Fail, match="sha256 is .*, expected 0000"):
+        download_packages([record], tmp_path / "pkgs", workers=1)
+    assert not list((tmp_path / "pkgs").iterdir())
+
+
+def test_download_resumes_partial_file(tmp_path, channel, http_channel):
+    record = add_package(channel, "numpy-1.0-0.tar.bz2", http_channel)
+    pkgs_dir = tmp_path / "pkgs"
+    pkgs_dir.mkdir()
+    content = (channel / "numpy-1.0-0.tar.bz2").read_bytes()
+    (pkgs_dir / "numpy-1.0-0.tar.bz2.partial").write_bytes(content[:1000])
+
+    assert download_packages([record], pkgs_dir, workers=1) == 1
+    assert (pkgs_dir / "numpy-1.0-0.tar.bz2").read_bytes() == content
+    assert RangeRequestHandler.requests == [("/numpy-1.0-0.tar.bz2", "bytes=1000-")]
+
+
+def test_download_http_error(tmp_path, http_channel):
+    record = {"url": f"{http_channel}/missing-1.0-0.conda", "md5": "0" * 32}
+    with pytest.raises(Fail, match="failed to download .*missing-1.0-0.conda"):
+        download_packages([record], tmp_path / "pkgs", workers=1)
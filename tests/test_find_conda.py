@@ -1,10 +1,33 @@
+import json
 import subprocess
+import sys
 from pathlib import Path
 
 import pytest
 from tox.tox_env.errors import Fail
 
-from tox_conda.conda import find_conda
+from tox_conda.backend import CondaBackend
+from tox_conda.conda import (
+    CondaFrontend,
+    _clear_conda_frontends,
+    find_conda,
+    find_conda_frontend,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_conda_frontends(monkeypatch):
+    monkeypatch.delenv("MAMBA_EXE", raising=False)
+    _clear_conda_frontends()
+    yield
+    _clear_conda_frontends()
+
+
+def make_executable(path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("#!/bin/sh\necho 1.5.8\n")
+    path.chmod(0o755)
+    return path
 
 
 def test_no_active_env(monkeypatch):
@@ -29,11 +52,11 @@ def test_with_active_env(monkeypatch):
     assert got_conda_path.resolve() == Path(conda_path).resolve()
 
 
-def test_which_success(monkeypatch, mocker):
-    conda_path = "/path/to/conda"
+def test_which_success(tmp_path, monkeypatch, mocker):
+    conda_path = make_executable(tmp_path / "bin" / "conda")
 
-    mocker.patch("shutil.which", return_value=conda_path)
-    mocker.patch("subprocess.run")
+    mocker.patch("shutil.which", return_value=str(conda_path))
+    run = mocker.patch("subprocess.run")
 
     monkeypatch.delenv("_CONDA_EXE", raising=False)
     monkeypatch.delenv("CONDA_EXE", raising=False)
@@ -41,13 +64,16 @@ def test_which_success(monkeypatch, mocker):
     got_conda_path = find_conda()
     assert got_conda_path is not None
     assert got_conda_path.resolve() == Path(conda_path).resolve()
+    # The executable is not started to check it
+    run.assert_not_called()
 
 
-def test_which_not_exec(monkeypatch, mocker):
-    conda_path = "/path/to/conda"
+@pytest.mark.skipif(sys.platform == "win32", reason="no executable permission bit on Windows")
+def test_which_not_exec(tmp_path, monkeypatch, mocker):
+    conda_path = tmp_path / "conda"
+    conda_path.touch(mode=0o644)
 
-    mocker.patch("shutil.which", return_value=conda_path)
-    mocker.patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "conda"))
+    mocker.patch("shutil.which", return_value=str(conda_path))
 
     monkeypatch.delenv("_CONDA_EXE", raising=False)
     monkeypatch.delenv("CONDA_EXE", raising=False)
@@ -64,3 +90,75 @@ def test_which_not_found(monkeypatch, mocker):
 
     with pytest.raises(Fail):
         find_conda()
+
+
+def test_find_conda_memoized(monkeypatch, mocker):
+    monkeypatch.delenv("_CONDA_EXE", raising=False)
+    monkeypatch.delenv("CONDA_EXE", raising=False)
+    which = mocker.patch("shutil.which", return_value=None)
+
+    with pytest.raises(Fail):
+        find_conda()
+
+    monkeypatch.setenv("CONDA_EXE", "/path/to/conda")
+    assert find_conda() == find_conda() == Path("/path/to/conda").resolve()
+    which_calls = which.call_count
+    find_conda()
+    assert which.call_count == which_calls
+
+
+def test_mamba_frontend_version(tmp_path, monkeypatch, mocker):
+    mamba_path = make_executable(tmp_path / "root" / "bin" / "mamba")
+    (tmp_path / "root" / "conda-meta").mkdir()
+    (tmp_path / "root" / "conda-meta" / "mamba-1.5.8-py311h3072747_0.json").touch()
+    (tmp_path / "root" / "conda-meta" / "mamba-env-0.1-0.json").touch()
+
+    monkeypatch.delenv("_CONDA_EXE", raising=False)
+    monkeypatch.delenv("CONDA_EXE", raising=False)
+    mocker.patch("shutil.which", side_effect=lambda n: str(mamba_path) if n == "mamba" else None)
+    run = mocker.patch("subprocess.run")
+
+    frontend = find_conda_frontend()
+    assert frontend.exe == mamba_path.resolve()
+    assert frontend.name == "mamba"
+    assert frontend.version == "1.5.8"
+    run.assert_not_called()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses a shell script as micromamba")
+def test_micromamba_frontend_version(tmp_path, tox_conda_cache_dir, monkeypatch, mocker):
+    micromamba_path = make_executable(tmp_path / "bin" / "micromamba")
+    monkeypatch.setenv("MAMBA_EXE", str(micromamba_path))
+    monkeypatch.delenv("_CONDA_EXE", raising=False)
+    monkeypatch.delenv("CONDA_EXE", raising=False)
+    mocker.patch("shutil.which", return_value=None)
+
+    frontend = find_conda_frontend()
+    assert frontend.name == "micromamba"
+    assert frontend.version == "1.5.8"
+    assert (tox_conda_cache_dir / "frontends.json").exists()
+
+    # The version of an unchanged binary is read back from the on-disk cache
+    _clear_conda_frontends()
+    run = mocker.patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "mm"))
+    assert find_conda_frontend().version == "1.5.8"
+    run.assert_not_called()
+
+
+def test_conda_frontend_pkgs_dirs(tmp_path, tox_conda_cache_dir, monkeypatch, mocker):
+    conda_path = tmp_path / "bin" / "conda"
+    conda_path.parent.mkdir(parents=True)
+    info = {"pkgs_dirs": [str(tmp_path / "custom" / "pkgs")]}
+    conda_path.write_text(f"#!/bin/sh\necho '{json.dumps(info)}'\n")
+    conda_path.chmod(0o755)
+    monkeypatch.delenv("CONDA_PKGS_DIRS", raising=False)
+
+    # pkgs_dirs configured in a .condarc are honoured
+    backend = CondaBackend(CondaFrontend(conda_path))
+    assert backend.pkgs_dirs() == [tmp_path / "custom" / "pkgs"]
+    assert (tox_conda_cache_dir / "frontend_info.json").exists()
+
+    # and read back from the on-disk cache while the configuration is unchanged
+    run = mocker.patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "conda"))
+    assert CondaBackend(CondaFrontend(conda_path)).pkgs_dirs() == [tmp_path / "custom" / "pkgs"]
+    run.assert_not_called()
@@ -0,0 +1,70 @@
+"""Tests for the content hashes of spec and environment files."""
+
+import pytest
+
+import tox_conda.hashing
+from tox_conda.hashing import hash_closure
+
+
+@pytest.fixture(autouse=True)
+def clear_memo(monkeypatch):
+    monkeypatch.setattr(tox_conda.hashing, "_MEMO", {})
+
+
+def test_hash_closure_follows_requirement_files(tmp_path):
+    (tmp_path / "spec.txt").write_text("numpy\n-r requirements.txt\n")
+    (tmp_path / "requirements.txt").write_text("--constraint=sub/constraints.txt\nblack\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "constraints.txt").write_text("black<24\n")
+    digest = hash_closure(tmp_path / "spec.txt")
+
+    (tmp_path / "sub" / "constraints.txt").write_text("black<25\n")
+    assert hash_closure(tmp_path / "spec.txt") != digest
+
+    (tmp_path / "sub" / "constraints.txt").write_text("black<24\n")
+    assert hash_closure(tmp_path / "spec.txt") == digest
+
+
+def test_hash_closure_follows_pip_section_of_env_file(tmp_path):
+    env_file = """
+        name: tox-conda
+        dependencies:
+          - numpy
+          - pip:
+            - -r requirements.txt
+    """
+    (tmp_path / "env.yml").write_text(env_file)
+    digest = hash_closure(tmp_path / "env.yml")
+
+    (tmp_path / "requirements.txt").write_text("pytest\n")
+    created = hash_closure(tmp_path / "env.yml")
+    assert created != digest
+
+    (tmp_path / "requirements.txt").write_text("pytest>=8\n")
+    assert hash_closure(tmp_path / "env.yml") != created
+
+
+def test_hash_closure_is_location_independent(tmp_path):
+    for project in ("a", "b"):
+        (tmp_path / project).mkdir()
+        (tmp_path / project / "spec.txt").write_text("-r requirements.txt\n-r spec.txt\n")
+        (tmp_path / project / "requirements.txt").write_text("black\n")
+    assert hash_closure(tmp_path / "a" / "spec.txt") == hash_closure(tmp_path / "b" / "spec.txt")
+
+
+def test_hash_closure_reads_unchanged_files_once(tmp_path, mocker, monkeypatch):
+    (tmp_path / "spec.txt").write_text("-r requirements.txt\n")
+    (tmp_path / "requirements.txt").write_text("black\n")
+    digest = mocker.spy(tox_conda.hashing, "_digest")
+    expected = hash_closure(tmp_path / "spec.txt")
+    assert hash_closure(tmp_path / "spec.txt") == expected
+    assert digest.call_count == 2
+
+    # a new process only has the memo on disk
+    monkeypatch.setattr(tox_conda.hashing, "_MEMO", {})
+    assert hash_closure(tmp_path / "spec.txt") == expected
+    assert digest.call_count == 2
+
+    (tmp_path / "requirements.txt").write_text("black>=24\n")
+    assert hash_closure(tmp_path / "spec.txt") != expected
+    assert digest.call_count == 3
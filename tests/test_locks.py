@@ -0,0 +1,44 @@
+"""Tests for the coordination of conda operations between tox processes."""
+
+import json
+import threading
+import time
+
+from tox_conda.locks import transaction_slot
+
+
+def test_transaction_slot_limit():
+    acquired = []
+
+    def third():
+        with transaction_slot(2) as waited:
+            acquired.append(waited)
+
+    with transaction_slot(2) as first, transaction_slot(2) as second:
+        assert first < 1 and second < 1
+        thread = threading.Thread(target=third)
+        thread.start()
+        time.sleep(0.3)
+        assert acquired == []
+    thread.join()
+    assert acquired[0] >= 0.3
+
+
+def test_transaction_slot_unlimited():
+    with transaction_slot(0) as first, transaction_slot(0) as second:
+        assert first == second == 0
+
+
+def test_conda_max_transactions(tmp_path, tox_project, mock_conda_env_runner):
+    ini = """
+    [tox]
+    conda_max_transactions = 1
+    [testenv:py123]
+    skip_install = True
+    """
+    result_json = tmp_path / "result.json"
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123", "--result-json", str(result_json))
+    outcome.assert_success()
+
+    journal = json.loads(result_json.read_text())["testenvs"]["py123"]
+    assert 0 <= journal["conda_lock_wait"] < 1
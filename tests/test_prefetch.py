@@ -0,0 +1,181 @@
+"""Tests for the conda-prefetch command."""
+
+import hashlib
+import json
+import shutil
+from fnmatch import fnmatch
+
+
+def make_channel(path, *names):
+    """A local channel with a package per name, and the FETCH records of a solve for them."""
+    path.mkdir(parents=True)
+    records = []
+    for name in names:
+        package = path / f"{name}-1.0-0.conda"
+        package.write_bytes(name.encode() * 1000)
+        md5 = hashlib.md5(package.read_bytes()).hexdigest()
+        records.append({"url": package.as_uri(), "md5": md5})
+    return records
+
+
+def test_conda_prefetch(
+    tmp_path, tox_project, mock_conda_env_runner, mock_conda_outputs, monkeypatch
+):
+    ini = """
+    [tox]
+    env_list = py123,py124
+    [testenv]
+    skip_install = True
+    conda_deps =
+        numpy
+    [testenv:py124]
+    conda_deps =
+        numpy
+        black
+    """
+    records = make_channel(tmp_path / "channel", "numpy", "black")
+    mock_conda_outputs["conda_prefetch-solve"] = json.dumps({"actions": {"FETCH": records}})
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(tmp_path / "pkgs"))
+    outcome = tox_project({"tox.ini": ini}).run("conda-prefetch")
+    outcome.assert_success()
+    assert "downloaded 2 of 2 packages" in outcome.out
+
+    solves = [cmd for cmd in mock_conda_env_runner if "--dry-run" in cmd]
+    assert len(solves) == 2
+    assert all(fnmatch(cmd, "*conda create -p * numpy* --dry-run --json") for cmd in solves)
+    # neither environment is created
+    assert len(mock_conda_env_runner) == 3
+    assert sorted(path.name for path in (tmp_path / "pkgs").iterdir()) == [
+        "black-1.0-0.conda",
+        "numpy-1.0-0.conda",
+        "urls.txt",
+    ]
+
+
+def test_conda_prefetch_env_file(tox_project, mock_conda_env_runner, mock_conda_outputs):
+    ini = """
+    [testenv]
+    skip_install = True
+    [testenv:py123]
+    conda_env = conda-env.yml
+    [testenv:py124]
+    conda_deps =
+        numpy
+    """
+    mock_conda_outputs["conda_prefetch-solve"] = json.dumps({"actions": {"FETCH": []}})
+    proj = tox_project({"tox.ini": ini, "conda-env.yml": "dependencies:\n  - numpy\n"})
+    outcome = proj.run("conda-prefetch", "-e", "py123,py124")
+    outcome.assert_success()
+    assert "py123: skipped, conda_env environments cannot be solved ahead" in outcome.out
+
+    # only py124 is solved
+    (solve,) = [cmd for cmd in mock_conda_env_runner if "--dry-run" in cmd]
+    assert "numpy" in solve
+
+
+def test_conda_order(tox_project):
+    ini = """
+    [tox]
+    env_list = py123,py124,py125,py126
+    [testenv]
+    runner = conda
+    skip_install = True
+    """
+    proj = tox_project({"tox.ini": ini})
+    costs = {
+        "py123": {"link": 50.0, "commands": 6.0},
+        "py124": {"solve": 60.0, "link": 30.0, "pip": 10.0, "commands": 5.0},
+        "py126": {"link": 200.0, "commands": 1.0},
+    }
+    (proj.path / ".tox").mkdir()
+    (proj.path / ".tox" / ".tox-conda-costs.json").write_text(json.dumps(costs))
+    # py126 exists, so it is only expected to run its commands
+    (proj.path / ".tox" / "py126").mkdir()
+
+    outcome = proj.run("conda-order")
+    outcome.assert_success()
+    assert outcome.out.splitlines()[-1] == "py125,py124,py123,py126"
+
+
+def test_prepare_later_envs(
+    tmp_path, tox_project, mock_conda_env_runner, mock_conda_outputs, monkeypatch
+):
+    ini = """
+    [tox]
+    env_list = py123,py124
+    conda_prepare_workers = 2
+    [testenv]
+    skip_install = True
+    conda_deps =
+        numpy
+    [testenv:py124]
+    conda_deps =
+        numpy
+        black
+    """
+    records = make_channel(tmp_path / "channel", "black")
+    mock_conda_outputs["conda_prefetch-solve"] = json.dumps({"actions": {"FETCH": records}})
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(tmp_path / "pkgs"))
+    outcome = tox_project({"tox.ini": ini}).run("-e", "py123,py124")
+    outcome.assert_success()
+
+    # only py124 is prepared, before it is created
+    solves = [index for index, cmd in enumerate(mock_conda_env_runner) if "--dry-run" in cmd]
+    assert len(solves) == 1
+    assert "black" in mock_conda_env_runner[solves[0]]
+    creates = [
+        index
+        for index, cmd in enumerate(mock_conda_env_runner)
+        if fnmatch(cmd, "*conda create -p *py124* --yes --quiet*") and "--dry-run" not in cmd
+    ]
+    assert solves[0] < creates[0]
+    assert (tmp_path / "pkgs" / "black-1.0-0.conda").exists()
+
+
+def test_prepare_skips_locked_envs(
+    tmp_path, tox_project, mock_conda_env_runner, mock_conda_outputs, monkeypatch
+):
+    ini = """
+    [tox]
+    env_list = py123,py124
+    conda_prepare_workers = 2
+    [testenv]
+    skip_install = True
+    conda_lock = True
+    [testenv:py124]
+    conda_deps =
+        black
+    """
+    records = make_channel(tmp_path / "channel", "black")
+    mock_conda_outputs["conda_prefetch-solve"] = json.dumps({"actions": {"FETCH": records}})
+    mock_conda_outputs["create_python_env-lock"] = "@EXPLICIT\n"
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(tmp_path / "pkgs"))
+    proj = tox_project({"tox.ini": ini})
+    proj.run("-e", "py123,py124").assert_success()
+    assert sum("--dry-run" in cmd for cmd in mock_conda_env_runner) == 1
+
+    # py124 is created from its lock file next time, so it is not solved ahead of time
+    shutil.rmtree(proj.path / ".tox" / "py124", ignore_errors=True)
+    del mock_conda_env_runner[:]
+    proj.run("-e", "py123,py124").assert_success()
+    assert not any("--dry-run" in cmd for cmd in mock_conda_env_runner)
+    assert any(fnmatch(cmd, "*conda create -p *py124* --file *") for cmd in mock_conda_env_runner)
+
+
+def test_prepare_not_in_parallel_runs(tox_project, mock_conda_env_runner):
+    ini = """
+    [tox]
+    env_list = py123,py124
+    conda_prepare_workers = 2
+    [testenv]
+    skip_install = True
+    conda_deps =
+        numpy
+    """
+    outcome = tox_project({"tox.ini": ini}).run("p", "-e", "py123,py124")
+    outcome.assert_success()
+
+    # the environments are created concurrently already, none is solved ahead of time
+    assert not any("--dry-run" in cmd for cmd in mock_conda_env_runner)
+    creates = [cmd for cmd in mock_conda_env_runner if fnmatch(cmd, "*conda create -p *")]
+    assert len(creates) == 2
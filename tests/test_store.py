@@ -0,0 +1,117 @@
+"""Shared store accounting and eviction tests."""
+
+import json
+import os
+import time
+
+import pytest
+
+from tox_conda.cli import main
+from tox_conda.store import Store, parse_size
+
+
+def add_env(store, key, files, last_used):
+    env = store.env_path(key)
+    env.mkdir(parents=True)
+    for name, content in files.items():
+        (env / name).write_bytes(content)
+    store.mark_env(key)
+    marker = store.root / "envs" / f"{key}.json"
+    marker.write_text(json.dumps({"key": key, "created": last_used}))
+    return env
+
+
+def disk_size(path):
+    stat = path.stat()
+    blocks = getattr(stat, "st_blocks", None)
+    return blocks * 512 if blocks is not None else stat.st_size
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(tmp_path / "store")
+
+
+def test_usage_counts_hardlinks_once(tmp_path, store):
+    old = add_env(store, "old", {"a": b"a" * 8192, "b": b"b" * 8192}, 1)
+    new = add_env(store, "new", {}, 2)
+    # shared between both templates: counted once, held by neither alone
+    os.link(old / "b", new / "b")
+    # linked from the package cache: never freed by the store
+    pkgs = tmp_path / "pkgs"
+    pkgs.mkdir()
+    (pkgs / "pkg").write_bytes(b"p" * 8192)
+    os.link(pkgs / "pkg", new / "pkg")
+
+    total, usages = store.usage()
+    a_size, b_size = disk_size(old / "a"), disk_size(old / "b")
+    assert total == a_size + b_size
+    assert [(usage.entry.key, usage.size) for usage in usages] == [("old", a_size), ("new", 0)]
+
+
+def test_evict_least_recently_used(store):
+    add_env(store, "old", {"a": b"a" * 8192}, 1)
+    add_env(store, "new", {"a": b"a" * 8192}, 2)
+    store.write_lock("lock", "@EXPLICIT\n")
+    store.touch_env("old")
+
+    total, usages = store.usage()
+    evicted = store.evict(total - 1)
+
+    assert [entry.key for entry in evicted] == ["new"]
+    assert not store.has_env("new")
+    assert store.has_env("old")
+    assert store.lock_path("lock").exists()
+
+    assert [entry.key for entry in store.evict(0)] == ["lock", "old"]
+    assert store.entries() == []
+
+
+def test_evict_skips_entries_in_use(store):
+    add_env(store, "old", {"a": b"a" * 8192}, 1)
+    add_env(store, "new", {"a": b"a" * 8192}, 2)
+
+    # a tox environment is cloning the least recently used template
+    with store.entry_lock("old"):
+        evicted = store.evict(0)
+
+    assert [entry.key for entry in evicted] == ["new"]
+    assert store.has_env("old")
+
+
+def test_entries_skip_vanishing_entries(store):
+    add_env(store, "kept", {}, 1)
+    store.write_lock("kept", "@EXPLICIT\n")
+    # entries another process is evicting: a marker without its content, a removed lock file
+    (store.root / "envs" / "partial.json").write_text("{}")
+    (store.root / "explicit" / "gone.txt").symlink_to(store.root / "explicit" / "removed.txt")
+
+    assert [(entry.kind, entry.key) for entry in store.entries()] == [
+        ("env", "kept"),
+        ("lock", "kept"),
+    ]
+
+
+def test_parse_size():
+    assert parse_size("512") == 512
+    assert parse_size("1.5K") == 1536
+    assert parse_size("20G") == 20 * 1024**3
+    assert parse_size("2 MiB") == 2 * 1024**2
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_cli(store, capsys):
+    add_env(store, "old", {"a": b"a" * 8192}, time.time())
+    store.write_lock("lock", "@EXPLICIT\n")
+
+    assert main(["--store", str(store.root), "list"]) == 0
+    out = capsys.readouterr().out
+    assert "env   old" in out
+    assert "lock  lock" in out
+
+    assert main(["--store", str(store.root), "gc", "--budget", "0"]) == 0
+    out = capsys.readouterr().out
+    assert "evicted env old" in out
+    assert "evicted lock lock" in out
+    assert store.entries() == []
@@ -0,0 +1,328 @@
+"""Command lines of the package managers tox-conda drives: the conda CLI and micromamba."""
+
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from ruamel.yaml import YAML
+from tox.tox_env.errors import Fail
+
+if TYPE_CHECKING:
+    from tox_conda.conda import CondaFrontend
+
+__all__ = []
+
+TearDown = Callable[[], None]
+
+SOLVERS = ("classic", "libmamba")
+
+_REPODATA_TTL_FOREVER = 10 * 365 * 24 * 3600
+
+
+def _no_tear_down() -> None:
+    return None
+
+
+class CondaBackend:
+    """Commands of the conda CLI, which conda and mamba implement.
+
+    Every method returns a shell-like command line for `shlex.split` that operates on the
+    environment described by the conda section of `CondaEnvRunner.python_cache()`.
+    """
+
+    name = "conda"
+    #: whether environments can be created as a clone of another environment
+    can_clone = True
+
+    def __init__(self, frontend: "CondaFrontend", offline: bool = False) -> None:
+        self.frontend = frontend
+        self.exe = frontend.exe
+        #: only use packages from the local package cache
+        self.offline = offline
+        #: solve with the repodata already on disk instead of revalidating it
+        self.use_index_cache = False
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(exe={str(self.exe)!r})"
+
+    def _command(self, subcommand: str) -> str:
+        return f"'{self.exe}' {subcommand}"
+
+    @staticmethod
+    def _target(conda_cache_conf: Dict[str, str]) -> str:
+        return f"{conda_cache_conf['env_spec']} '{conda_cache_conf['env']}'"
+
+    def check_solver(self, solver: str) -> None:
+        """Fail unless the frontend can solve environments with `solver`."""
+        if solver not in SOLVERS:
+            raise Fail(
+                f"Invalid conda_solver value '{solver}'. Must be one of {', '.join(SOLVERS)}."
+            )
+        if self.frontend.name != "conda":
+            # mamba and micromamba always solve with libmamba and have no --solver option
+            if solver != "libmamba":
+                raise Fail(f"{self.frontend.name} only supports the libmamba solver")
+            return
+
+        version = _version_tuple(self.frontend.version)
+        if version is not None and version < (22, 11):
+            raise Fail(
+                f"conda_solver requires conda>=22.11, but {self.exe} is conda "
+                f"{self.frontend.version}"
+            )
+        root = self.frontend.root
+        if solver == "libmamba" and root is not None:
+            if not any((root / "conda-meta").glob("conda-libmamba-solver-*.json")):
+                raise Fail(f"the libmamba solver is not installed in {root}")
+
+    def _transaction_args(self, conda_cache_conf: Dict[str, str]) -> str:
+        """Options of the commands that solve and link packages."""
+        args = ""
+        solver = conda_cache_conf.get("solver")
+        if solver is not None and self.frontend.name == "conda":
+            args += f" --solver={solver}"
+        if self.offline:
+            args += " --offline"
+        elif self.use_index_cache:
+            args += self._index_cache_args()
+        return args
+
+    def _index_cache_args(self) -> str:
+        return " --use-index-cache"
+
+    def pkgs_dirs(self) -> List[Path]:
+        """The package cache directories, as configured for the frontend.
+
+        When the frontend cannot tell, they are derived from its location like conda's defaults.
+        """
+        if os.environ.get("CONDA_PKGS_DIRS"):
+            return [Path(path) for path in os.environ["CONDA_PKGS_DIRS"].split(",")]
+        configured = self.frontend.info.get("pkgs_dirs")
+        if configured:
+            return [Path(path) for path in configured]
+        pkgs_dirs = [Path.home() / ".conda" / "pkgs"]
+        if self.frontend.root is not None:
+            pkgs_dirs.insert(0, self.frontend.root / "pkgs")
+        return pkgs_dirs
+
+    def missing_from_pkgs_dirs(self, lock: Path) -> List[str]:
+        """Return the packages of an explicit lock file that are not in the package cache."""
+        pkgs_dirs = self.pkgs_dirs()
+        missing = []
+        for line in lock.read_text().splitlines():
+            line = line.strip()
+            if not line or line.startswith("#") or line == "@EXPLICIT":
+                continue
+            filename = line.split("#", 1)[0].rsplit("/", 1)[-1]
+            dist = re.sub(r"(\.tar\.bz2|\.conda)$", "", filename)
+            cached = (pkgs_dir / name for pkgs_dir in pkgs_dirs for name in (filename, dist))
+            if not any(path.exists() for path in cached):
+                missing.append(dist)
+        return missing
+
+    @staticmethod
+    def missing_packages(output: str) -> List[str]:
+        """Extract the packages the solver could not find from the output of a failed command."""
+        # PackagesNotFoundError: The following packages are not available from current channels:
+        #
+        #   - numpy=1.99
+        #
+        # Current channels:
+        match = re.search(r"PackagesNotFoundError:[^\n]*\n\s*\n((?:\s*- [^\n]+\n?)+)", output)
+        if match is None:
+            return []
+        return [line.strip()[2:] for line in match.group(1).splitlines() if line.strip()]
+
+    def create_command(
+        self, python_packages: str, conda_cache_conf: Dict[str, str], solve_once: bool = False
+    ) -> Tuple[str, TearDown]:
+        cmd = (
+            f"{self._command('create')} {self._target(conda_cache_conf)}"
+            f" {python_packages} --yes --quiet{self._transaction_args(conda_cache_conf)}"
+        )
+        for arg in conda_cache_conf.get("create_args", []):
+            cmd += f" '{arg}'"
+
+        if solve_once:
+            # Everything the install step would add, so the environment is solved and
+            # linked in a single transaction.
+            for channel in conda_cache_conf.get("channels", []):
+                cmd += f" --channel {channel}"
+            for arg in conda_cache_conf.get("install_args", []):
+                cmd += f" {arg}"
+            for dep in conda_cache_conf.get("deps", []):
+                cmd += f" {dep}"
+            if "spec" in conda_cache_conf:
+                cmd += f" --file={conda_cache_conf['spec']}"
+
+        return cmd, _no_tear_down
+
+    def env_create_command(
+        self, python: str, conda_cache_conf: Dict[str, str]
+    ) -> Tuple[str, TearDown]:
+        env_file = self._env_file_with_python(Path(conda_cache_conf["env_path"]).resolve(), python)
+        cmd = (
+            f"{self._command('env create')} {self._target(conda_cache_conf)}"
+            f" --file '{env_file}' --quiet --force{self._transaction_args(conda_cache_conf)}"
+        )
+        return cmd, env_file.unlink
+
+    @staticmethod
+    def _env_file_with_python(env_path: Path, python: str) -> Path:
+        # conda env create does not have a --channel argument nor does it take
+        # dependencies specifications (e.g., python=3.8). These must all be specified
+        # in the conda-env.yml file
+        yaml = YAML()
+        env_file = yaml.load(env_path)
+        env_file["dependencies"].append(python)
+
+        tmp_env_file = tempfile.NamedTemporaryFile(
+            dir=env_path.parent,
+            prefix="tox_conda_tmp",
+            suffix=env_path.suffix,
+            delete=False,
+        )
+        yaml.dump(env_file, tmp_env_file)
+        tmp_env_file.close()
+        return Path(tmp_env_file.name)
+
+    def install_command(
+        self, python_packages: str, conda_cache_conf: Dict[str, str]
+    ) -> Optional[str]:
+        # Check if there is anything to install
+        if "deps" not in conda_cache_conf and "spec" not in conda_cache_conf:
+            return None
+
+        cmd = f"{self._command('install')} --quiet --yes {self._target(conda_cache_conf)}"
+        cmd += self._transaction_args(conda_cache_conf)
+        for channel in conda_cache_conf.get("channels", []):
+            cmd += f" --channel {channel}"
+
+        # Add end-user conda install args
+        for arg in conda_cache_conf.get("install_args", []):
+            cmd += f" {arg}"
+
+        # We include the python version in the conda requirements in order to make
+        # sure that none of the other conda requirements inadvertently downgrade
+        # python in this environment. If any of the requirements are in conflict
+        # with the installed python version, installation will fail (which is what
+        # we want).
+        cmd += f" {python_packages}"
+
+        for dep in conda_cache_conf.get("deps", []):
+            cmd += f" {dep}"
+
+        if "spec" in conda_cache_conf:
+            cmd += f" --file={conda_cache_conf['spec']}"
+
+        return cmd
+
+    def create_from_lock_command(self, lock: Path, conda_cache_conf: Dict[str, str]) -> str:
+        return (
+            f"{self._command('create')} {self._target(conda_cache_conf)}"
+            f" --file '{lock}' --yes --quiet{' --offline' if self.offline else ''}"
+        )
+
+    def dry_run_command(self, python_packages: str, conda_cache_conf: Dict[str, str]) -> str:
+        """Solve everything `create_command` and `install_command` would add, as JSON."""
+        cmd, _ = self.create_command(python_packages, conda_cache_conf, solve_once=True)
+        return f"{cmd} --dry-run --json"
+
+    def lock_command(self, conda_cache_conf: Dict[str, str]) -> str:
+        """Print the installed packages as an explicit lock file."""
+        return f"{self._command('list')} {self._target(conda_cache_conf)} --explicit --md5"
+
+    def clone_command(self, source: str, target: str) -> str:
+        return (
+            f"{self._command('create')} -p '{target}' --clone '{source}' --yes --quiet --offline"
+        )
+
+    def run_command(self, conda_cache_conf: Dict[str, str]) -> str:
+        """Prefix that runs the appended command in the environment."""
+        return f"{self._command('run')} {self._target(conda_cache_conf)} --live-stream"
+
+    def env_list_command(self) -> str:
+        return f"{self._command('env list')} --json"
+
+
+class MicromambaBackend(CondaBackend):
+    """Commands of micromamba, a static binary with its own solver and CLI.
+
+    micromamba keeps its package cache and named environments in a root prefix, which is
+    ``MAMBA_ROOT_PREFIX`` unless `root_prefix` is given.
+    """
+
+    name = "micromamba"
+    can_clone = False
+
+    def __init__(
+        self, frontend: "CondaFrontend", root_prefix: Optional[str] = None, offline: bool = False
+    ) -> None:
+        super().__init__(frontend, offline)
+        self.root_prefix = root_prefix
+
+    def _command(self, subcommand: str) -> str:
+        cmd = super()._command(subcommand)
+        if self.root_prefix:
+            cmd += f" --root-prefix '{self.root_prefix}'"
+        return cmd
+
+    def env_create_command(
+        self, python: str, conda_cache_conf: Dict[str, str]
+    ) -> Tuple[str, TearDown]:
+        # micromamba creates environments from environment files with its regular create
+        env_file = self._env_file_with_python(Path(conda_cache_conf["env_path"]).resolve(), python)
+        cmd = (
+            f"{self._command('create')} {self._target(conda_cache_conf)}"
+            f" --file '{env_file}' --yes --quiet{self._transaction_args(conda_cache_conf)}"
+        )
+        return cmd, env_file.unlink
+
+    def _index_cache_args(self) -> str:
+        # micromamba has no --use-index-cache, but takes how long repodata stays valid
+        return f" --repodata-ttl {_REPODATA_TTL_FOREVER}"
+
+    def pkgs_dirs(self) -> List[Path]:
+        if os.environ.get("CONDA_PKGS_DIRS"):
+            return super().pkgs_dirs()
+        root_prefix = self.root_prefix or os.environ.get("MAMBA_ROOT_PREFIX")
+        if root_prefix:
+            return [Path(root_prefix) / "pkgs"]
+        base = self.frontend.info.get("base environment")
+        if base:
+            return [Path(base) / "pkgs"]
+        # the root prefix micromamba uses when none is configured
+        return [Path.home() / "micromamba" / "pkgs"]
+
+    @staticmethod
+    def missing_packages(output: str) -> List[str]:
+        # error    libmamba Could not solve for environment specs
+        #     The following package could not be installed
+        #     └─ numpy 1.99**  does not exist (perhaps a typo or a missing channel).
+        return [
+            " ".join(match.split())
+            for match in re.findall(r"[└├]─ ([^\n]+?)\s+does not exist", output)
+        ]
+
+    def lock_command(self, conda_cache_conf: Dict[str, str]) -> str:
+        return f"{self._command('env export')} {self._target(conda_cache_conf)} --explicit --md5"
+
+    def clone_command(self, source: str, target: str) -> str:
+        raise Fail("micromamba cannot clone environments, conda_store requires conda or mamba")
+
+    def run_command(self, conda_cache_conf: Dict[str, str]) -> str:
+        # micromamba run does not capture the output of the command, so it needs no
+        # --live-stream
+        return f"{self._command('run')} {self._target(conda_cache_conf)}"
+
+
+def _version_tuple(version: Optional[str]) -> Optional[Tuple[int, ...]]:
+    """Parse the numeric part of a version like ``23.11.0`` for comparisons."""
+    numbers = []
+    for part in (version or "").split("."):
+        if not part.isdigit():
+            break
+        numbers.append(int(part))
+    return tuple(numbers) or None
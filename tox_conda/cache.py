@@ -0,0 +1,97 @@
+"""Small JSON backed caches that let tox-conda skip conda invocations between tox runs."""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from filelock import FileLock
+from platformdirs import user_cache_dir
+
+__all__ = []
+
+
+def cache_dir() -> Path:
+    """Directory for caches shared by all tox environments, projects and tox invocations.
+
+    Defaults to the user cache directory and can be moved with ``TOX_CONDA_CACHE_DIR``.
+    """
+    return Path(os.environ.get("TOX_CONDA_CACHE_DIR") or user_cache_dir("tox-conda"))
+
+
+def lock_path(name: str) -> Path:
+    """Path of the lock file guarding a resource, e.g. a file in the package cache."""
+    lock_dir = cache_dir() / ".locks"
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    return lock_dir / f"{hashlib.blake2b(name.encode(), digest_size=16).hexdigest()}.lock"
+
+
+class JsonCache:
+    """A JSON file holding a mapping of keys to cached values.
+
+    Updates re-read the file under a file lock and replace it atomically, so several tox
+    processes may share one cache file without corrupting it or losing each other's updates.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._content: Optional[Dict[str, Any]] = None
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            content = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return content if isinstance(content, dict) else {}
+
+    def get(self, key: str) -> Optional[Any]:
+        if self._content is None:
+            self._content = self._read()
+        return self._content.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        with FileLock(str(lock_path(str(self.path.absolute())))):
+            content = self._read()
+            content[key] = value
+            write_json(self.path, content)
+        self._content = content
+
+
+def write_json(path: Path, content: Any) -> None:
+    """Replace a JSON file atomically, so readers never see a partially written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    with open(fd, "w") as tmp_file:
+        json.dump(content, tmp_file, indent=2)
+    os.replace(tmp_name, path)
+
+
+def stat_fingerprint(*paths: Union[str, Path]) -> List[Optional[List[Any]]]:
+    """Fingerprint files and directories by their modification time and size.
+
+    Missing paths are fingerprinted as ``None``, so creating them changes the fingerprint too.
+    The result is JSON serializable and compares equal after a round trip through JSON.
+    """
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            fingerprint.append(None)
+        else:
+            fingerprint.append([str(path), stat.st_mtime_ns, stat.st_size])
+    return fingerprint
+
+
+def env_fingerprint(prefix: Union[str, Path]) -> List[Optional[List[Any]]]:
+    """Fingerprint the state of a conda environment that affects its activation.
+
+    Every conda transaction appends to ``conda-meta/history``, and the activation scripts
+    live in ``etc/conda/activate.d``.
+    """
+    prefix = Path(prefix)
+    activate_d = prefix / "etc" / "conda" / "activate.d"
+    scripts = sorted(activate_d.iterdir()) if activate_d.is_dir() else []
+    return stat_fingerprint(prefix / "conda-meta" / "history", activate_d, *scripts)
@@ -0,0 +1,52 @@
+"""The ``tox-conda`` command to inspect and clean up the shared store."""
+
+import argparse
+import datetime
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from tox_conda.store import Store, format_size, parse_size
+
+__all__ = []
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="tox-conda", description="Maintain the environments and lock files tox-conda keeps."
+    )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=None,
+        help="store directory, defaults to the tox-conda cache directory",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show the entries of the store, least recently used first")
+    gc = commands.add_parser("gc", help="evict least recently used entries to fit a budget")
+    gc.add_argument("--budget", required=True, help="disk budget of the store, e.g. 20G")
+    args = parser.parse_args(argv)
+
+    store = Store(args.store)
+    if args.command == "list":
+        total, usages = store.usage()
+        for usage in usages:
+            last_used = datetime.datetime.fromtimestamp(usage.entry.last_used)
+            print(
+                f"{usage.entry.kind:<5} {usage.entry.key} {format_size(usage.size):>8}"
+                f"  {last_used:%Y-%m-%d %H:%M}"
+            )
+        print(f"total {format_size(total)} in {store.root}")
+        return 0
+
+    try:
+        budget = parse_size(args.budget)
+    except ValueError as exception:
+        parser.error(str(exception))
+    for entry in store.evict(budget):
+        print(f"evicted {entry.kind} {entry.key}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
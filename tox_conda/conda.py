@@ -1,5 +1,6 @@
-import hashlib
+import copy
 import json
+import logging
 import os
 import re
 import shlex
@@ -7,29 +8,55 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import cached_property
 from io import BytesIO, TextIOWrapper
 from pathlib import Path
 from time import sleep
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-from ruamel.yaml import YAML
 from tox.execute.api import (
     Execute,
     ExecuteInstance,
     ExecuteOptions,
     ExecuteRequest,
+    Outcome,
     StdinSource,
     SyncWrite,
 )
 from tox.execute.local_sub_process import LocalSubProcessExecuteInstance, LocalSubProcessExecutor
 from tox.tox_env.api import ToxEnv
-from tox.tox_env.errors import Fail
+from tox.tox_env.errors import Fail, Recreate
 from tox.tox_env.info import Info
 from tox.tox_env.installer import Installer
-from tox.tox_env.python.api import PythonInfo, VersionInfo
+from tox.tox_env.python.api import Python, PythonInfo, VersionInfo
 from tox.tox_env.python.pip.pip_install import Pip
 from tox.tox_env.python.runner import PythonRun
+from tox_conda.backend import CondaBackend, MicromambaBackend
+from tox_conda.cache import JsonCache, cache_dir, env_fingerprint, stat_fingerprint
+from tox_conda.costs import CostDb, cost_phase
+from tox_conda.download import DEFAULT_WORKERS, download_packages, writable_pkgs_dir
 from tox_conda.FilteredInfo import FilteredInfo
+from tox_conda.hashing import hash_closure
+from tox_conda.locks import transaction_slot
+from tox_conda.prepare import preparer
+from tox_conda.repodata import mark_refreshed, repodata_key, use_index_cache
+from tox_conda.store import Store, claim_budget_check, parse_size, store_key
+from tox_conda.timing import TimedExecuteInstance, session_report
 from virtualenv.discovery.py_spec import PythonSpec
 
 if TYPE_CHECKING:
@@ -37,6 +64,26 @@ if TYPE_CHECKING:
 
 __all__ = []
 
+# Dumps the environment as seen by a process started through `conda run`, i.e. after
+# the activation scripts of the conda environment were applied.
+ACTIVATION_SCRIPT = "import json, os; print(json.dumps(dict(os.environ)))"
+
+# Describes a base interpreter for `CondaEnvRunner._get_python`.
+PYTHON_INFO_SCRIPT = (
+    "import json, platform, sys;"
+    "print(json.dumps({'implementation': platform.python_implementation(),"
+    " 'version_info': list(sys.version_info), 'version': sys.version.splitlines()[0],"
+    " 'is_64': sys.maxsize > 2**32, 'platform': platform.system()}))"
+)
+
+# Reports all interpreter paths tox asks for in a single process.
+INTERPRETER_SCRIPT = (
+    "import json, sys, sysconfig; paths = sysconfig.get_paths();"
+    "print(json.dumps({'executable': sys.executable, 'prefix': sys.prefix,"
+    " 'scripts': paths['scripts'], 'purelib': paths['purelib'], 'platlib': paths['platlib'],"
+    " 'version_info': list(sys.version_info)}))"
+)
+
 
 class CondaEnvRunner(PythonRun):
     # Can be overridden in tests
@@ -51,8 +98,19 @@ class CondaEnvRunner(PythonRun):
     def __init__(self, create_args: "ToxEnvCreateArgs") -> None:
         self._installer = None
         self._executor = None
+        self._conda_run_executor = None
         self._external_executor = None
+        self._activation = None
+        self._interpreter = None
         self._created = False
+        self._python_cache = None
+        self._backend = None
+        self._repodata_refresh_key = None
+        self._lock_wait = 0.0
+        self._costs: Dict[str, float] = {}
+        self._commands: List[Dict[str, Any]] = []
+        self._spans: List[Dict[str, Any]] = []
+        self._run_info: Dict[str, Any] = {}
         self._ignore_env_name_mismatch = True
         ignore_env_name_mismatch = [
             o for o in create_args.options.override if o.key == "ignore_env_name_mismatch"
@@ -68,42 +126,37 @@ class CondaEnvRunner(PythonRun):
     def _get_python(self, base_python: List[str]) -> Optional[PythonInfo]:
         exe_path = base_python[0]
 
-        output = self._run_pure(
-            [
-                exe_path,
-                "-c",
-                (
-                    "import os, platform, sys;"
-                    "print(platform.python_implementation());"
-                    "print(platform.sys.version_info);"
-                    " print(sys.version.split(os.linesep)[0]);"
-                    "print(sys.maxsize > 2**32);print(platform.system())"
-                ),
-            ],
-            "_get_python",
-        )
-        output = output.split(os.linesep)
+        # The probe result is shared by all environments using the same interpreter, and it
+        # stays valid as long as the executable is not replaced.
+        resolved = shutil.which(exe_path, path=self.environment_variables.get("PATH")) or exe_path
+        try:
+            stat = os.stat(resolved)
+        except OSError:
+            fingerprint = None
+        else:
+            fingerprint = [stat.st_ino, stat.st_mtime_ns, stat.st_size]
 
-        implementation, version_info, version, is_64, platform_name = output
+        python_cache = JsonCache(cache_dir() / "python.json")
+        cached = python_cache.get(resolved)
+        if fingerprint is not None and cached is not None and cached["fingerprint"] == fingerprint:
+            info = cached["info"]
+        else:
+            output = self._run_pure([exe_path, "-c", PYTHON_INFO_SCRIPT], "_get_python")
+            info = json.loads(output)
+            if fingerprint is not None:
+                python_cache.set(resolved, {"fingerprint": fingerprint, "info": info})
 
-        is_64 = bool(is_64)
-        match = re.match(
-            (
-                r"sys\.version_info\(major=(\d+), minor=(\d+), micro=(\d+), releaselevel='(\w+)',"
-                r" serial=(\d+)\)"
-            ),
-            version_info,
-        )
-        version_info = VersionInfo(
-            major=int(match.group(1)),
-            minor=int(match.group(2)),
-            micro=int(match.group(3)),
-            releaselevel=match.group(4),
-            serial=int(match.group(5)),
-        )
+        version_info = VersionInfo(*info["version_info"])
         extra = {"executable_path": exe_path}
 
-        return PythonInfo(implementation, version_info, version, is_64, platform_name, extra)
+        return PythonInfo(
+            info["implementation"],
+            version_info,
+            info["version"],
+            info["is_64"],
+            info["platform"],
+            extra,
+        )
 
     @property
     def cache(self) -> Info:
@@ -164,6 +217,18 @@ class CondaEnvRunner(PythonRun):
         return sys.platform
 
     def python_cache(self) -> Dict[str, Any]:
+        # Computed once per environment and only recomputed when one of the hashed files changes.
+        if self._python_cache is not None:
+            files, fingerprint, value = self._python_cache
+            if stat_fingerprint(*files) == fingerprint:
+                return copy.deepcopy(value)
+
+        files = []
+        value = self._compute_python_cache(files)
+        self._python_cache = files, stat_fingerprint(*files), value
+        return copy.deepcopy(value)
+
+    def _compute_python_cache(self, files: List[Path]) -> Dict[str, Any]:
         conda_dict = {}
 
         conda_name = getattr(self.options, "conda_name", None)
@@ -178,147 +243,368 @@ class CondaEnvRunner(PythonRun):
             conda_dict["env"] = str(self.env_dir)
             env_path = Path(self.conf["conda_env"]).resolve()
             conda_dict["env_path"] = str(env_path)
-            conda_dict["env_hash"] = hash_file(Path(self.conf["conda_env"]).resolve())
+            conda_dict["env_hash"] = hash_closure(env_path, files)
         else:
             conda_dict["env_spec"] = "-p"
             conda_dict["env"] = str(self.env_dir)
 
+        # Settings are canonicalized, so cosmetic edits in the configuration do not recreate the
+        # environment. Only the order of dependencies is irrelevant; channel order is priority.
         _, conda_deps = self.conf["conda_deps"].unroll()
         if conda_deps:
-            conda_dict["deps"] = conda_deps
+            conda_dict["deps"] = sorted({canonical_match_spec(dep) for dep in conda_deps})
 
         conda_spec = self.conf["conda_spec"]
         if conda_spec:
             conda_dict["spec"] = conda_spec
-            conda_dict["spec_hash"] = hash_file(Path(conda_spec).resolve())
+            conda_dict["spec_hash"] = hash_closure(Path(conda_spec), files)
 
-        conda_channels = self.conf["conda_channels"]
+        conda_channels = _canonical_args(self.conf["conda_channels"])
         if conda_channels:
-            conda_dict["channels"] = conda_channels
+            conda_dict["channels"] = list(dict.fromkeys(conda_channels))
 
-        conda_install_args = self.conf["conda_install_args"]
+        conda_install_args = _canonical_args(self.conf["conda_install_args"])
         if conda_install_args:
             conda_dict["install_args"] = conda_install_args
 
-        conda_create_args = self.conf["conda_create_args"]
+        conda_create_args = _canonical_args(self.conf["conda_create_args"])
         if conda_create_args:
             conda_dict["create_args"] = conda_create_args
 
+        conda_solver = self.conf["conda_solver"]
+        if conda_solver:
+            conda_dict["solver"] = conda_solver
+
         base = super().python_cache()
         base.update({"conda": conda_dict},)
         return base
 
+    def ensure_python_env(self) -> None:
+        session_preparer = preparer()
+        if session_preparer is not None:
+            session_preparer.start(self)
+        if claim_budget_check():
+            self._evict_from_store()
+        conf = self.python_cache()
+        with self.cache.compare(conf, Python.__name__) as (eq, old):
+            if old is None:  # does not exist -> create
+                self.create_python_env()
+            elif eq is False:  # exists but changed -> update in place or recreate
+                update = conda_deps_update(old, conf)
+                if update is None:
+                    raise Recreate(self._diff_msg(conf, old))
+                self.update_python_env(update)
+
+    def update_python_env(self, update: "CondaDepsUpdate") -> None:
+        """Apply a change of `conda_deps` to the existing environment."""
+        self._activation = None
+        self._interpreter = None
+        conda_cache_conf = self.python_cache()["conda"]
+        if "solver" in conda_cache_conf:
+            self.backend.check_solver(conda_cache_conf["solver"])
+        self._apply_repodata_policy(conda_cache_conf)
+
+        if update.install:
+            python_packages = " ".join(self._get_python_packages())
+            install_conf = {key: value for key, value in conda_cache_conf.items() if key != "spec"}
+            install_conf["deps"] = update.install
+            install_command = self.backend.install_command(python_packages, install_conf)
+            self._run_transaction(shlex.split(install_command), "update_python_env-install")
+
     def create_python_env(self) -> None:
-        conda_exe = find_conda()
+        self._activation = None
+        self._interpreter = None
+        backend = self.backend
+        frontend = backend.frontend
+        logging.info(
+            "using %s %s at %s (%s backend)",
+            frontend.name,
+            frontend.version or "",
+            backend.exe,
+            backend.name,
+        )
         python_packages = self._get_python_packages()
         python_packages = " ".join(python_packages)
 
+        session_preparer = preparer()
+        prepared = session_preparer is not None and session_preparer.wait(self.name)
+
         conda_cache_conf = self.python_cache()["conda"]
+        if "solver" in conda_cache_conf:
+            backend.check_solver(conda_cache_conf["solver"])
+        self._apply_repodata_policy(conda_cache_conf)
+
+        template_key = None
+        use_store = self.conf["conda_store"] and conda_cache_conf["env_spec"] == "-p"
+        if use_store and not backend.can_clone:
+            logging.warning("conda_store is ignored, %s cannot clone environments", backend.name)
+            use_store = False
+        if use_store:
+            template_key = store_key(conda_cache_conf, python_packages)
+            if self._clone_from_store(conda_cache_conf, template_key):
+                self._created = True
+                return
+
+        lock_key = None
+        if self.conf["conda_lock"] and not self.conf["conda_env"]:
+            lock_key = store_key(conda_cache_conf, python_packages)
+            lock = Store().lock_path(lock_key)
+            if lock.exists() and self._create_from_lock(conda_cache_conf, lock):
+                Store().touch_lock(lock_key)
+                self._created = True
+                return
+
+        download_ahead = self.conf["conda_download_workers"] and not self.conf["conda_env"]
+        if download_ahead and not prepared:
+            # Solve once more, but download with more connections than conda uses.
+            self.prepare()
 
         if self.conf["conda_env"]:
-            create_command, tear_down = CondaEnvRunner._generate_env_create_command(
-                conda_exe, python_packages, conda_cache_conf
+            create_command, tear_down = backend.env_create_command(
+                python_packages, conda_cache_conf
             )
+            solve_once = False
         else:
-            create_command, tear_down = CondaEnvRunner._generate_create_command(
-                conda_exe, python_packages, conda_cache_conf
+            solve_once = self.conf["conda_solve_once"]
+            create_command, tear_down = backend.create_command(
+                python_packages, conda_cache_conf, solve_once
             )
         try:
             create_command_args = shlex.split(create_command)
-            self._run_pure(create_command_args, "create_python_env-create")
+            self._run_transaction(create_command_args, "create_python_env-create")
         finally:
             tear_down()
 
-        install_command = CondaEnvRunner._generate_install_command(
-            conda_exe, python_packages, conda_cache_conf
-        )
+        install_command = None
+        if not solve_once:
+            install_command = backend.install_command(python_packages, conda_cache_conf)
         if install_command:
             install_command_args = shlex.split(install_command)
-            self._run_pure(install_command_args, "create_python_env-install")
+            self._run_transaction(install_command_args, "create_python_env-install")
+        self._created = True
 
-    @staticmethod
-    def _generate_env_create_command(
-        conda_exe: Path, python: str, conda_cache_conf: Dict[str, str]
-    ):
-        env_path = Path(conda_cache_conf["env_path"]).resolve()
-        # conda env create does not have a --channel argument nor does it take
-        # dependencies specifications (e.g., python=3.8). These must all be specified
-        # in the conda-env.yml file
-        yaml = YAML()
-        env_file = yaml.load(env_path)
-        env_file["dependencies"].append(python)
-
-        tmp_env_file = tempfile.NamedTemporaryFile(
-            dir=env_path.parent,
-            prefix="tox_conda_tmp",
-            suffix=env_path.suffix,
-            delete=False,
-        )
-        yaml.dump(env_file, tmp_env_file)
-        tmp_env_file.close()
+        if lock_key is not None or template_key is not None:
+            self._evict_from_store()
+        if lock_key is not None:
+            self._capture_lock(conda_cache_conf, lock_key)
+        if template_key is not None:
+            self._save_to_store(conda_cache_conf, template_key)
 
-        cmd = (
-            f"'{conda_exe}' env create {conda_cache_conf['env_spec']} '{conda_cache_conf['env']}'"
-            f" --file '{tmp_env_file.name}' --quiet --force"
-        )
+    def solve_downloads(self) -> List[Dict[str, Any]]:
+        """Solve the environment without creating it.
 
-        def tear_down():
-            return Path(tmp_env_file.name).unlink()
+        :return: the records of the packages that are not in the package cache yet
+        """
+        conda_cache_conf = self.python_cache()["conda"]
+        if "env_path" in conda_cache_conf:
+            raise Fail("environments created from conda_env cannot be solved ahead of time")
+        if "solver" in conda_cache_conf:
+            self.backend.check_solver(conda_cache_conf["solver"])
+        self._apply_repodata_policy(conda_cache_conf)
+        python_packages = " ".join(self._get_python_packages())
+        with tempfile.TemporaryDirectory(prefix="tox-conda-") as tmp_dir:
+            # A prefix that does not exist, so the solve ignores the current environment
+            solve_conf = {**conda_cache_conf, "env_spec": "-p", "env": str(Path(tmp_dir) / "env")}
+            cmd = self.backend.dry_run_command(python_packages, solve_conf)
+            output = self._run_transaction(shlex.split(cmd), "conda_prefetch-solve")
+        return json.loads(output).get("actions", {}).get("FETCH", [])
+
+    def prepare(self) -> None:
+        """Solve the environment and download its packages, without creating it."""
+        if self.backend.offline:
+            return
+        if writable_pkgs_dir(self.backend.pkgs_dirs()) is None:
+            logging.warning("no writable package cache directory, leaving downloads to conda")
+            return
+        records = self.solve_downloads()
+        with self._span("download") as span:
+            self.download_packages(records)
+        self._add_cost("download", span["wall"])
 
-        return cmd, tear_down
+    def reuses_store(self) -> bool:
+        """Whether creating the environment would clone a template or install a lock file.
 
-    @staticmethod
-    def _generate_create_command(
-        conda_exe: Path, python_packages: str, conda_cache_conf: Dict[str, str]
-    ):
-        cmd = (
-            f"'{conda_exe}' create {conda_cache_conf['env_spec']} '{conda_cache_conf['env']}'"
-            f" {python_packages} --yes --quiet"
-        )
-        for arg in conda_cache_conf.get("create_args", []):
-            cmd += f" '{arg}'"
+        Neither solves the environment, so preparing such an environment is wasted work.
+        """
+        if self.conf["conda_env"]:
+            return False
+        conda_cache_conf = self.python_cache()["conda"]
+        key = store_key(conda_cache_conf, " ".join(self._get_python_packages()))
+        if self.conf["conda_store"] and self.backend.can_clone and Store().has_env(key):
+            return True
+        return bool(self.conf["conda_lock"]) and Store().lock_path(key).exists()
 
-        def tear_down():
-            return None
+    def download_packages(self, records: List[Dict[str, Any]]) -> int:
+        """Download packages given by records of `solve_downloads` into the package cache.
 
-        return cmd, tear_down
+        :return: the number of downloaded packages
+        """
+        pkgs_dir = writable_pkgs_dir(self.backend.pkgs_dirs())
+        if pkgs_dir is None:
+            raise Fail("none of the package cache directories is writable")
+        workers = self.conf["conda_download_workers"] or DEFAULT_WORKERS
+        return download_packages(records, pkgs_dir, workers)
+
+    def execute(
+        self,
+        cmd: Sequence[Union[Path, str]],
+        stdin: StdinSource,
+        show: Optional[bool] = None,
+        cwd: Optional[Path] = None,
+        run_id: str = "",
+        executor: Optional[Execute] = None,
+    ) -> Outcome:
+        outcome = super().execute(cmd, stdin, show, cwd, run_id, executor)
+        phase = cost_phase(run_id)
+        if phase is not None:
+            self._add_cost(phase, outcome.elapsed)
+        return outcome
+
+    def _add_cost(self, phase: str, seconds: float) -> None:
+        self._costs[phase] = self._costs.get(phase, 0.0) + seconds
+
+    def record_run(self) -> None:
+        """Persist the phase durations and commands of this run.
+
+        The phase durations order the environments of later runs, the commands are reported in
+        ``.tox/.tox-conda-report.json`` with the other environments of the tox session.
+        """
+        if self._commands:
+            report = {
+                **self._run_info,
+                "phases": {phase: round(seconds, 3) for phase, seconds in self._costs.items()},
+                "spans": list(self._spans),
+                "commands": list(self._commands),
+            }
+            path = Path(self.core["work_dir"]) / ".tox-conda-report.json"
+            trace = getattr(self.options, "conda_trace", None)
+            session_report().add(path, self.name, report, trace)
+        if self._costs:
+            CostDb(self.core["work_dir"]).record(self.name, self._costs)
+            self._costs = {}
+
+    def _journal(self, key: str, value: Any) -> None:
+        """Add to the ``--result-json`` report and to the report of `record_run`."""
+        self.journal[key] = value
+        self._run_info[key] = value
+
+    @contextmanager
+    def _span(self, name: str) -> Iterator[Dict[str, Any]]:
+        """Record a phase that does not run a command, for the trace of ``--conda-trace``."""
+        span = {"name": name, "start": round(time.time(), 3)}
+        start = time.monotonic()
+        try:
+            yield span
+        finally:
+            span["wall"] = round(time.monotonic() - start, 3)
+            self._spans.append(span)
 
-    @staticmethod
-    def _generate_install_command(
-        conda_exe: Path, python_packages: str, conda_cache_conf: Dict[str, str]
-    ):
-        # Check if there is anything to install
-        if "deps" not in conda_cache_conf and "spec" not in conda_cache_conf:
-            return None
+    def _timed(self, instance: ExecuteInstance) -> ExecuteInstance:
+        return TimedExecuteInstance(instance, self._commands.append)
 
-        cmd = (
-            f"'{conda_exe}' install --quiet --yes"
-            f" {conda_cache_conf['env_spec']} '{conda_cache_conf['env']}'"
-        )
-        for channel in conda_cache_conf.get("channels", []):
-            cmd += f" --channel {channel}"
+    def _teardown(self) -> None:
+        self.record_run()
+        super()._teardown()
 
-        # Add end-user conda install args
-        for arg in conda_cache_conf.get("install_args", []):
-            cmd += f" {arg}"
+    def _evict_from_store(self) -> None:
+        """Trim the store to its disk budget, if one is configured.
 
-        # We include the python version in the conda requirements in order to make
-        # sure that none of the other conda requirements inadvertently downgrade
-        # python in this environment. If any of the requirements are in conflict
-        # with the installed python version, installation will fail (which is what
-        # we want).
-        cmd += f" {python_packages}"
+        This runs when a tox session sets up its first conda environment and before adding to
+        the store.
+        """
+        budget = self.core["conda_store_budget"]
+        if budget is None:
+            return
+        try:
+            budget_bytes = parse_size(budget)
+        except ValueError as exception:
+            raise Fail(f"Invalid conda_store_budget: {exception}")
+        for entry in Store().evict(budget_bytes):
+            logging.info("evicted %s %s from the tox-conda store", entry.kind, entry.key)
 
-        for dep in conda_cache_conf.get("deps", []):
-            cmd += f" {dep}"
+    def _clone_from_store(self, conda_cache_conf: Dict[str, str], key: str) -> bool:
+        """Create the environment as a clone of the template environment with the same key.
 
-        if "spec" in conda_cache_conf:
-            cmd += f" --file={conda_cache_conf['spec']}"
+        Cloning links the packages from the package cache and rewrites the prefix in them, so
+        neither the solver nor any download runs.
 
-        return cmd
+        :return: whether there was a template to clone
+        """
+        store = Store()
+        with store.entry_lock(key):
+            if not store.has_env(key):
+                return False
+            cmd = self.backend.clone_command(str(store.env_path(key)), conda_cache_conf["env"])
+            self._run_throttled(shlex.split(cmd), "create_python_env-clone")
+            store.touch_env(key)
+        return True
+
+    def _save_to_store(self, conda_cache_conf: Dict[str, str], key: str):
+        """Keep a clone of the freshly created environment as the template for its key."""
+        store = Store()
+        with store.entry_lock(key):
+            if store.has_env(key):  # saved by a concurrent environment with the same key
+                return
+            template = store.prepare_env(key)
+            cmd = self.backend.clone_command(conda_cache_conf["env"], str(template))
+            self._run_throttled(shlex.split(cmd), "create_python_env-store")
+            store.mark_env(key)
+
+    def _create_from_lock(self, conda_cache_conf: Dict[str, str], lock: Path) -> bool:
+        """Create the environment from an explicit lock file, without running the solver."""
+        if self.backend.offline:
+            missing = self.backend.missing_from_pkgs_dirs(lock)
+            if missing:
+                raise _offline_failure(missing)
+        cmd = self.backend.create_from_lock_command(lock, conda_cache_conf)
+        try:
+            self._run_throttled(shlex.split(cmd), "create_python_env-explicit")
+        except Fail as exception:
+            logging.warning("ignoring lock file %s: %s", lock, exception)
+            lock.unlink(missing_ok=True)
+            return False
+        return True
+
+    def _capture_lock(self, conda_cache_conf: Dict[str, str], lock_key: str):
+        """Record the solved packages of the environment as an explicit lock file."""
+        cmd = self.backend.lock_command(conda_cache_conf)
+        explicit = self._run_pure(shlex.split(cmd), "create_python_env-lock")
+        if "@EXPLICIT" in explicit:
+            Store().write_lock(lock_key, explicit + "\n")
+
+    @property
+    def conda_offline(self) -> bool:
+        """Whether packages may only come from the local package cache."""
+        return getattr(self.options, "conda_offline", False) or self.conf["conda_offline"]
+
+    @property
+    def backend(self) -> CondaBackend:
+        """The package manager that creates and runs the environment."""
+        if self._backend is None:
+            with self._span("discovery"):
+                self._backend = self._find_backend()
+        return self._backend
+
+    def _find_backend(self) -> CondaBackend:
+        conda_backend = self.conf["conda_backend"]
+        if conda_backend == "micromamba":
+            frontend = find_micromamba()
+        elif conda_backend == "conda":
+            frontend = find_conda_frontend()
+        else:
+            raise Fail(
+                f"Invalid conda_backend value '{conda_backend}'. "
+                "Must be one of 'conda' or 'micromamba'."
+            )
+        # A micromamba found as the fallback frontend does not implement the conda CLI
+        if frontend.name == "micromamba":
+            root_prefix = self.conf["conda_root_prefix"]
+            return MicromambaBackend(frontend, root_prefix, self.conda_offline)
+        return CondaBackend(frontend, self.conda_offline)
 
     @property
     def external_executor(self) -> Execute:
+        timed = self._timed
 
         class CondaExecutor(LocalSubProcessExecutor):
 
@@ -329,7 +615,7 @@ class CondaEnvRunner(PythonRun):
                 out: SyncWrite,
                 err: SyncWrite,
             ) -> ExecuteInstance:
-                return CondaEnvRunner._execute_instance_factory(request, options, out, err)
+                return timed(CondaEnvRunner._execute_instance_factory(request, options, out, err))
 
         if self._external_executor is None:
             self._external_executor = CondaExecutor(self.options.is_colored)
@@ -338,14 +624,30 @@ class CondaEnvRunner(PythonRun):
     @property
     def executor(self) -> Execute:
 
-        def get_conda_command_prefix():
-            conda_exe = find_conda()
-            cache_conf = self.python_cache()
-            cmd = (
-                f"'{conda_exe}' run"
-                f" {cache_conf['conda']['env_spec']} '{cache_conf['conda']['env']}' --live-stream"
+        def build_request(request: ExecuteRequest) -> ExecuteRequest:
+            conda_executor = self.conf["conda_executor"]
+            if conda_executor == "conda-run":
+                return self._conda_run_request(request)
+            if conda_executor == "direct":
+                return self._direct_request(request)
+            raise Fail(
+                f"Invalid conda_executor value '{conda_executor}'. "
+                "Must be one of 'conda-run' or 'direct'."
             )
-            return shlex.split(cmd)
+
+        if self._executor is None:
+            self._executor = self._make_executor(build_request)
+        return self._executor
+
+    @property
+    def conda_run_executor(self) -> Execute:
+        """Executor that wraps every command in `conda run`, regardless of `conda_executor`."""
+        if self._conda_run_executor is None:
+            self._conda_run_executor = self._make_executor(self._conda_run_request)
+        return self._conda_run_executor
+
+    def _make_executor(self, build_request: Callable[[ExecuteRequest], ExecuteRequest]):
+        timed = self._timed
 
         class CondaExecutor(LocalSubProcessExecutor):
 
@@ -356,23 +658,89 @@ class CondaEnvRunner(PythonRun):
                 out: SyncWrite,
                 err: SyncWrite,
             ) -> ExecuteInstance:
-                conda_cmd = get_conda_command_prefix()
-
-                conda_request = ExecuteRequest(
-                    conda_cmd + request.cmd,
-                    request.cwd,
-                    request.env,
-                    request.stdin,
-                    request.run_id,
-                    request.allow,
-                )
+                conda_request = build_request(request)
                 # This creates a LocalSubProcessExecuteInstance in real environment,
                 # and it allows testing with dependency injection.
-                return CondaEnvRunner._execute_instance_factory(conda_request, options, out, err)
+                instance = CondaEnvRunner._execute_instance_factory(
+                    conda_request, options, out, err
+                )
+                return timed(instance)
+
+        return CondaExecutor(self.options.is_colored)
+
+    def _conda_run_request(self, request: ExecuteRequest) -> ExecuteRequest:
+        cmd = self.backend.run_command(self.python_cache()["conda"])
+        return ExecuteRequest(
+            shlex.split(cmd) + request.cmd,
+            request.cwd,
+            request.env,
+            request.stdin,
+            request.run_id,
+            request.allow,
+        )
 
-        if self._executor is None:
-            self._executor = CondaExecutor(self.options.is_colored)
-        return self._executor
+    def _direct_request(self, request: ExecuteRequest) -> ExecuteRequest:
+        return ExecuteRequest(
+            request.cmd,
+            request.cwd,
+            _activate(request.env, self._get_activation()),
+            request.stdin,
+            request.run_id,
+            request.allow,
+        )
+
+    @property
+    def _env_cache(self) -> JsonCache:
+        return JsonCache(Path(self.env_dir) / ".tox-conda.json")
+
+    def _load_env_cache(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a value persisted next to the environment if the environment is unchanged."""
+        value = self._env_cache.get(key)
+        if value is None or value["fingerprint"] != env_fingerprint(value["prefix"]):
+            return None
+        return value
+
+    def _store_env_cache(self, key: str, value: Dict[str, Any], prefix: str) -> Dict[str, Any]:
+        value["prefix"] = prefix
+        value["fingerprint"] = env_fingerprint(prefix)
+        self._env_cache.set(key, value)
+        return value
+
+    def _get_activation(self) -> Dict[str, Any]:
+        """Return the changes `conda activate` makes to the environment variables.
+
+        They are computed once with a `conda run` probe and persisted next to the environment.
+        The persisted value is reused across tox invocations until a conda transaction or a
+        change to the activation scripts modifies the environment's fingerprint.
+        """
+        if self._activation is None:
+            activation = self._load_env_cache("activation")
+            if activation is None:
+                cmd = ["python", "-c", ACTIVATION_SCRIPT]
+                output = self._run_in_conda(cmd, "activation_env", self.conda_run_executor)
+                activated = json.loads(output)
+                activation = self._store_env_cache(
+                    "activation",
+                    _activation_delta(self.environment_variables, activated),
+                    activated.get("CONDA_PREFIX", str(self.env_dir)),
+                )
+            self._activation = activation
+        return self._activation
+
+    def _get_interpreter(self) -> Dict[str, Any]:
+        """Return the paths of the interpreter in the conda environment.
+
+        A single probe collects everything `env_python`, `env_bin_dir` and the site package
+        folders need; its result is persisted like the activation.
+        """
+        if self._interpreter is None:
+            interpreter = self._load_env_cache("interpreter")
+            if interpreter is None:
+                output = self._run_python_script_in_conda(INTERPRETER_SCRIPT, "env_interpreter")
+                probed = json.loads(output)
+                interpreter = self._store_env_cache("interpreter", probed, probed["prefix"])
+            self._interpreter = interpreter
+        return self._interpreter
 
     @property
     def installer(self) -> Installer[Any]:
@@ -381,8 +749,7 @@ class CondaEnvRunner(PythonRun):
         return self._installer
 
     def prepend_env_var_path(self) -> List[Path]:
-        conda_exe: Path = find_conda()
-        return [conda_exe.parent]
+        return [self.backend.exe.parent]
 
     def _default_pass_env(self) -> List[str]:
         env = super()._default_pass_env()
@@ -401,27 +768,25 @@ class CondaEnvRunner(PythonRun):
 
     def env_site_package_dir(self) -> Path:
         """The site package folder within the tox environment."""
-        script = 'from sysconfig import get_paths; print(get_paths()["purelib"])'
-        path = self._run_python_script_in_conda(script, "env_site_package_dir")
-        return Path(path).resolve()
+        return Path(self._get_interpreter()["purelib"]).resolve()
+
+    def env_site_package_dir_plat(self) -> Path:
+        """The platform specific site package folder within the tox environment."""
+        return Path(self._get_interpreter()["platlib"]).resolve()
 
     def env_python(self) -> Path:
         """The python executable within the tox environment."""
-        script = "import sys; print(sys.executable)"
-        path = self._run_in_conda(script, "env_python")
-        return Path(path).resolve()
+        return Path(self._get_interpreter()["executable"]).resolve()
 
     def env_bin_dir(self) -> Path:
         """The binary folder within the tox environment."""
-        script = 'from sysconfig import get_paths; print(get_paths()["scripts"])'
-        path = self._run_in_conda(script, "env_bin_dir")
-        return Path(path).resolve()
+        return Path(self._get_interpreter()["scripts"]).resolve()
 
     def _run_python_script_in_conda(self, script: str, run_id: str):
         cmd = "python -c".split() + [script]
         return self._run_in_conda(cmd, run_id)
 
-    def _run_in_conda(self, cmd: List[str], run_id: str):
+    def _run_in_conda(self, cmd: List[str], run_id: str, executor: Optional[Execute] = None):
         self._ensure_python_env_exists()
 
         request = ExecuteRequest(
@@ -432,7 +797,7 @@ class CondaEnvRunner(PythonRun):
             run_id,
         )
 
-        return self._call_executor(self.executor, request)
+        return self._call_executor(executor or self.executor, request)
 
     def _run_pure(self, cmd: List[str], run_id: str):
         request = ExecuteRequest(
@@ -445,6 +810,53 @@ class CondaEnvRunner(PythonRun):
 
         return self._call_executor(self.external_executor, request)
 
+    def _apply_repodata_policy(self, conda_cache_conf: Dict[str, Any]) -> None:
+        """Decide whether the next commands revalidate the repodata of the channels.
+
+        Only the first command of a tox run revalidates it, or none within
+        ``conda_repodata_ttl`` of an earlier run. Environment files bring their own channels,
+        so they always revalidate.
+        """
+        backend = self.backend
+        ttl = self.core["conda_repodata_ttl"]
+        key = repodata_key(str(backend.exe), conda_cache_conf.get("channels", []))
+        if backend.offline:
+            policy = "offline"
+        elif "env_path" not in conda_cache_conf and use_index_cache(key, ttl):
+            policy = "index-cache"
+        else:
+            policy = "refresh"
+        backend.use_index_cache = policy == "index-cache"
+        self._repodata_refresh_key = key if policy == "refresh" else None
+        self._journal("conda_repodata", {"policy": policy, "ttl": ttl})
+
+    def _run_throttled(self, cmd: List[str], run_id: str):
+        """Run a conda transaction once one of the ``conda_max_transactions`` slots is free."""
+        with transaction_slot(self.core["conda_max_transactions"]) as waited:
+            if waited > 1:
+                logging.info("waited %.1fs for a conda transaction slot", waited)
+            if waited > 0:
+                slot_wait = {"name": "transaction slot", "start": round(time.time() - waited, 3)}
+                self._spans.append({**slot_wait, "wall": round(waited, 3)})
+            self._lock_wait += waited
+            self._journal("conda_lock_wait", round(self._lock_wait, 3))
+            return self._run_pure(cmd, run_id)
+
+    def _run_transaction(self, cmd: List[str], run_id: str):
+        """Run a command that solves and links packages into the environment."""
+        try:
+            output = self._run_throttled(cmd, run_id)
+        except Fail as exception:
+            missing = self.backend.missing_packages(str(exception))
+            if self.backend.offline and missing:
+                raise _offline_failure(missing) from exception
+            raise
+        if self._repodata_refresh_key is not None:
+            mark_refreshed(self._repodata_refresh_key)
+            self._repodata_refresh_key = None
+            self.backend.use_index_cache = "env_path" not in self.python_cache()["conda"]
+        return output
+
     def _call_executor(self, executor: Execute, request: ExecuteRequest):
 
         class NamedBytesIO(BytesIO):
@@ -461,9 +873,13 @@ class CondaEnvRunner(PythonRun):
 
         out_err = out, err
 
+        start = time.monotonic()
         with executor.call(request, True, out_err, self) as execute_status:
             while execute_status.wait() is None:
                 sleep(0.01)
+            phase = cost_phase(request.run_id)
+            if phase is not None:
+                self._add_cost(phase, time.monotonic() - start)
             if execute_status.exit_code != 0:
                 raise Fail(
                     f"Failed to execute operation '{request.cmd}'. "
@@ -481,12 +897,11 @@ class CondaEnvRunner(PythonRun):
         if self._created:
             return
 
-        conda_exe = find_conda()
-        cmd = f"'{conda_exe}' env list --json"
-        cmd_list = shlex.split(cmd)
-        result = self._run_pure(cmd_list, "_ensure_python_env_exists")
-        envs = json.loads(result)
-        if str(self.env_dir) in envs["envs"]:
+        is_conda_env = _is_conda_prefix(Path(self.env_dir))
+        if is_conda_env is None:
+            # Ambiguous on disk, ask conda about the environments it knows
+            is_conda_env = self._is_known_conda_env()
+        if is_conda_env:
             self._created = True
         else:
             raise Fail(
@@ -494,8 +909,210 @@ class CondaEnvRunner(PythonRun):
                 "Delete it first manually."
             )
 
+    def _is_known_conda_env(self) -> bool:
+        cmd_list = shlex.split(self.backend.env_list_command())
+        result = self._run_pure(cmd_list, "_ensure_python_env_exists")
+        envs = json.loads(result)
+        return str(self.env_dir) in envs["envs"]
+
+
+def _offline_failure(missing: List[str]) -> Fail:
+    packages = "".join(f"\n  - {package}" for package in missing)
+    return Fail(f"conda_offline is set, but the package cache is missing:{packages}")
+
+
+class CondaDepsUpdate(NamedTuple):
+    """Changes to `conda_deps` that can be applied to an existing environment."""
+
+    #: added dependencies and dependencies with a changed specification
+    install: List[str]
+
+
+def match_spec_name(spec: str) -> str:
+    """Return the package name of a conda match spec like `conda-forge::numpy >=1.20`."""
+    match = re.match(r"\s*(?:[\w.\-/:]+::)?([\w.\-]+)", spec)
+    return match.group(1).lower() if match else spec.strip().lower()
+
+
+def canonical_match_spec(spec: str) -> str:
+    """Normalize the spelling of a conda match spec.
+
+    Whitespace around version operators is dropped and the package name is lower-cased, e.g.
+    `NumPy >= 1.20 , <2` becomes `numpy>=1.20,<2`. Whitespace separating a version from a
+    build string (`numpy 1.20 py38*`) is significant and kept.
+    """
+    spec = " ".join(spec.split())
+    match = re.fullmatch(r"((?:[\w.\-/:]+::)?)([\w.\-]+) ?(.*)", spec)
+    if match is None:
+        return spec
+    channel, name, constraint = match.groups()
+    constraint = re.sub(r" ?([<>=!~,|]+) ?", r"\1", constraint)
+    separator = " " if constraint and constraint[0] not in "<>=!~[" else ""
+    return f"{channel}{name.lower()}{separator}{constraint}"
+
+
+def _canonical_args(args: Optional[List[str]]) -> List[str]:
+    """Collapse whitespace in list settings whose order is significant, dropping blank lines."""
+    return [" ".join(arg.split()) for arg in args or [] if arg.strip()]
+
+
+def conda_deps_update(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[CondaDepsUpdate]:
+    """Diff two `python_cache()` values of an environment.
+
+    Dropping a dependency recreates the environment: ``conda remove`` would also remove every
+    package depending on it, including dependencies that are still listed.
+
+    :return: the dependency changes to apply when only additions to `conda_deps` or changed
+        specifications are the difference, or None when the environment needs to be recreated
+    """
+    old_conda, new_conda = old.get("conda", {}), new.get("conda", {})
+    old_rest = {key: value for key, value in old.items() if key != "conda"}
+    new_rest = {key: value for key, value in new.items() if key != "conda"}
+    if old_rest != new_rest:
+        return None
+    if {key: value for key, value in old_conda.items() if key != "deps"} != {
+        key: value for key, value in new_conda.items() if key != "deps"
+    }:
+        return None
+
+    old_deps, new_deps = old_conda.get("deps", []), new_conda.get("deps", [])
+    if {match_spec_name(dep) for dep in old_deps} - {match_spec_name(dep) for dep in new_deps}:
+        return None
+    return CondaDepsUpdate(install=[dep for dep in new_deps if dep not in old_deps])
+
+
+class CondaFrontend:
+    """A conda compatible executable: conda, mamba or micromamba."""
+
+    def __init__(self, exe: Path) -> None:
+        self.exe = exe
+        name = exe.stem.lower()
+        self.name = name if name in ("mamba", "micromamba") else "conda"
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(exe={str(self.exe)!r}, name={self.name!r})"
+
+    @cached_property
+    def root(self) -> Optional[Path]:
+        """The prefix conda or mamba is installed in, None for a standalone micromamba."""
+        # <root>/bin/conda, <root>/condabin/conda or <root>\Scripts\conda.exe
+        root = self.exe.parent.parent
+        return root if (root / "conda-meta").is_dir() else None
+
+    @cached_property
+    def version(self) -> Optional[str]:
+        """The version of the frontend, read from its package record when possible."""
+        if self.root is not None:
+            for record in (self.root / "conda-meta").glob(f"{self.name}-*.json"):
+                name, version, _ = record.stem.rsplit("-", 2)
+                if name == self.name:
+                    return version
+
+        # A static micromamba has no package record, so ask it once per binary.
+        try:
+            mtime = self.exe.stat().st_mtime_ns
+        except OSError:
+            return None
+        frontend_cache = JsonCache(cache_dir() / "frontends.json")
+        cached = frontend_cache.get(str(self.exe))
+        if cached is not None and cached["mtime"] == mtime:
+            return cached["version"]
+        try:
+            output = subprocess.run(
+                [str(self.exe), "--version"], capture_output=True, text=True, check=True
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        version = output.split()[-1] if output.split() else None
+        frontend_cache.set(str(self.exe), {"mtime": mtime, "version": version})
+        return version
+
+    @cached_property
+    def info(self) -> Dict[str, Any]:
+        """The output of ``info --json``, empty if it cannot be read.
+
+        It is read once per binary and state of the configuration files and kept in the cache
+        directory next to the versions of the frontends.
+        """
+        try:
+            mtime = self.exe.stat().st_mtime_ns
+        except OSError:
+            return {}
+        fingerprint = [
+            mtime,
+            [os.environ.get(var) for var in _CONFIG_VARS],
+            stat_fingerprint(*_config_files(self.root)),
+        ]
+        info_cache = JsonCache(cache_dir() / "frontend_info.json")
+        cached = info_cache.get(str(self.exe))
+        if cached is not None and cached["fingerprint"] == fingerprint:
+            return cached["info"]
+        try:
+            output = subprocess.run(
+                [str(self.exe), "info", "--json"], capture_output=True, text=True, check=True
+            ).stdout
+            info = json.loads(output)
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            return {}
+        info_cache.set(str(self.exe), {"fingerprint": fingerprint, "info": info})
+        return info
+
+
+# Environment variables and configuration files that change the output of `info --json`
+_CONFIG_VARS = ("CONDARC", "MAMBARC", "CONDA_PKGS_DIRS", "MAMBA_ROOT_PREFIX")
+
+
+def _config_files(root: Optional[Path]) -> List[Path]:
+    home = Path.home()
+    files = [
+        Path("/etc/conda/.condarc"),
+        Path("/etc/conda/condarc"),
+        home / ".config" / "conda" / ".condarc",
+        home / ".config" / "conda" / "condarc",
+        home / ".conda" / ".condarc",
+        home / ".conda" / "condarc",
+        home / ".condarc",
+        home / ".mambarc",
+    ]
+    if root is not None:
+        files[2:2] = [root / ".condarc", root / "condarc"]
+    files.extend(Path(os.environ[var]) for var in ("CONDARC", "MAMBARC") if os.environ.get(var))
+    return files
+
+
+_FRONTENDS: Dict[Tuple[Optional[str], ...], CondaFrontend] = {}
+_FRONTENDS_LOCK = threading.Lock()
+
 
 def find_conda() -> Path:
+    return find_conda_frontend().exe
+
+
+def find_conda_frontend() -> CondaFrontend:
+    """Return the conda frontend to use, resolved once per process and environment."""
+    key = tuple(os.environ.get(var) for var in ("_CONDA_EXE", "CONDA_EXE", "MAMBA_EXE", "PATH"))
+    with _FRONTENDS_LOCK:
+        frontend = _FRONTENDS.get(key)
+        if frontend is None:
+            frontend = _FRONTENDS[key] = CondaFrontend(_resolve_conda_exe())
+    return frontend
+
+
+def find_micromamba() -> CondaFrontend:
+    """Return the micromamba frontend, independent of the conda frontends that are installed."""
+    for micromamba_exe in (os.environ.get("MAMBA_EXE"), shutil.which("micromamba")):
+        if micromamba_exe and Path(micromamba_exe).stem.lower() == "micromamba":
+            return CondaFrontend(Path(micromamba_exe).resolve())
+    raise Fail("Failed to find 'micromamba' executable.")
+
+
+def _clear_conda_frontends() -> None:
+    """Forget the resolved frontends, so the next lookup resolves them again."""
+    with _FRONTENDS_LOCK:
+        _FRONTENDS.clear()
+
+
+def _resolve_conda_exe() -> Path:
     # This should work if we're not already in an environment
     conda_exe = os.environ.get("_CONDA_EXE")
     if conda_exe:
@@ -506,20 +1123,52 @@ def find_conda() -> Path:
     if conda_exe:
         return Path(conda_exe).resolve()
 
+    # The file found on PATH is only checked for the executable bit, it is not started
     conda_exe = shutil.which("conda")
+    if conda_exe and os.access(conda_exe, os.X_OK):
+        return Path(conda_exe).resolve()
+
+    # Set by micromamba's (and mamba 2's) shell integration
+    conda_exe = os.environ.get("MAMBA_EXE")
     if conda_exe:
-        conda_exe = Path(conda_exe).resolve()
-        try:
-            subprocess.run([str(conda_exe), "-h"], stdout=subprocess.DEVNULL)
-            return conda_exe
-        except subprocess.CalledProcessError:
-            pass
+        return Path(conda_exe).resolve()
+
+    for name in ("mamba", "micromamba"):
+        conda_exe = shutil.which(name)
+        if conda_exe and os.access(conda_exe, os.X_OK):
+            return Path(conda_exe).resolve()
 
     raise Fail("Failed to find 'conda' executable.")
 
 
-def hash_file(file: Path) -> str:
-    with open(file, "rb") as f:
-        sha1 = hashlib.sha1()
-        sha1.update(f.read())
-        return sha1.hexdigest()
+def _is_conda_prefix(prefix: Path) -> Optional[bool]:
+    """Check whether `prefix` is a conda environment by looking at its `conda-meta` folder.
+
+    :return: True for a prefix with a transaction history and package records, False when there
+        is no `conda-meta` folder at all, and None when only a part of it is present
+    """
+    conda_meta = prefix / "conda-meta"
+    if not conda_meta.is_dir():
+        return False
+    if (conda_meta / "history").is_file() and next(conda_meta.glob("*.json"), None):
+        return True
+    return None
+
+
+def _activation_delta(base: Dict[str, str], activated: Dict[str, str]) -> Dict[str, Any]:
+    """Compute the PATH entries and variables that activating an environment adds to `base`."""
+    base_path = base.get("PATH", "").split(os.pathsep)
+    path = [entry for entry in activated.get("PATH", "").split(os.pathsep) if entry]
+    env = {key: value for key, value in activated.items() if key != "PATH"}
+    return {
+        "path": [entry for entry in path if entry not in base_path],
+        "env": {key: value for key, value in env.items() if base.get(key) != value},
+    }
+
+
+def _activate(env: Dict[str, str], activation: Dict[str, Any]) -> Dict[str, str]:
+    """Apply an activation delta computed by `_activation_delta` to `env`."""
+    activated = dict(env)
+    activated.update(activation["env"])
+    activated["PATH"] = os.pathsep.join(activation["path"] + [env.get("PATH", "")])
+    return activated
@@ -0,0 +1,66 @@
+"""Durations of the phases of conda environments, used to start expensive environments first."""
+
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from tox_conda.cache import JsonCache
+
+__all__ = []
+
+#: phases that only run when an environment is created or updated; ``link`` includes the solve
+#: of conda commands that were not solved ahead of time
+PROVISION_PHASES = ("solve", "download", "link", "pip")
+PHASES = PROVISION_PHASES + ("commands",)
+
+
+def cost_phase(run_id: str) -> Optional[str]:
+    """Return the phase a command of a tox environment belongs to, None for probes."""
+    if run_id == "conda_prefetch-solve":
+        return "solve"
+    if run_id.startswith(("create_python_env-", "update_python_env-")):
+        return None if run_id == "create_python_env-lock" else "link"
+    if run_id.startswith("install_"):
+        return "pip"
+    if run_id.startswith(("commands_pre[", "commands[", "commands_post[")):
+        return "commands"
+    return None
+
+
+class CostDb:
+    """The phase durations recorded by earlier runs, in ``.tox/.tox-conda-costs.json``."""
+
+    def __init__(self, work_dir: Path) -> None:
+        self._cache = JsonCache(Path(work_dir) / ".tox-conda-costs.json")
+
+    def get(self, env_name: str) -> Dict[str, float]:
+        return self._cache.get(env_name) or {}
+
+    def record(self, env_name: str, durations: Dict[str, float]) -> None:
+        """Merge the durations of a run into the recorded ones.
+
+        A run that linked the environment replaces all recorded provisioning phases, so phases
+        it skipped (e.g. an ahead of time solve) do not linger from an older configuration.
+        """
+        costs = self.get(env_name)
+        if "link" in durations:
+            costs = {key: value for key, value in costs.items() if key not in PROVISION_PHASES}
+        costs.update({key: round(value, 3) for key, value in durations.items()})
+        self._cache.set(env_name, costs)
+
+    def estimate(self, env_name: str, provisioned: bool) -> Optional[float]:
+        """Seconds the environment is expected to take, None if it never ran."""
+        costs = self.get(env_name)
+        if not costs:
+            return None
+        phases = ("commands",) if provisioned else PHASES
+        return sum(costs.get(phase, 0.0) for phase in phases)
+
+
+def by_cost(names: List[str], estimate: Callable[[str], Optional[float]]) -> List[str]:
+    """Sort environments from the most to the least expensive one.
+
+    Environments without an estimate may be the most expensive ones, so they come first; ties
+    keep their order.
+    """
+    costs = {name: estimate(name) for name in names}
+    return sorted(names, key=lambda name: (costs[name] is not None, -(costs[name] or 0.0)))
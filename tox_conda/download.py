@@ -0,0 +1,116 @@
+"""Parallel downloads of conda packages into the package cache, ahead of conda."""
+
+import hashlib
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from filelock import FileLock
+from tox.tox_env.errors import Fail
+
+from tox_conda.cache import lock_path
+
+__all__ = []
+
+#: download threads of `tox conda-prefetch` unless conda_download_workers is set
+DEFAULT_WORKERS = 8
+
+_CHUNK_SIZE = 1024 * 1024
+_TIMEOUT = 60
+
+
+def writable_pkgs_dir(pkgs_dirs: List[Path]) -> Optional[Path]:
+    """Return the first package cache directory conda would write to, like conda does."""
+    for pkgs_dir in pkgs_dirs:
+        existing = next((path for path in (pkgs_dir, *pkgs_dir.parents) if path.exists()), None)
+        if existing is not None and os.access(existing, os.W_OK):
+            return pkgs_dir
+    return None
+
+
+def download_packages(records: List[Dict[str, Any]], pkgs_dir: Path, workers: int) -> int:
+    """Download the packages of solver records (``url``, ``md5``, ``sha256``) into `pkgs_dir`.
+
+    Downloads run in a pool of `workers` threads, resume partial files left by an interrupted
+    run and are verified against the checksums of the records. The URLs are registered in
+    ``urls.txt``, so conda links the packages without downloading them again.
+
+    :return: the number of downloaded packages
+    """
+    pkgs_dir.mkdir(parents=True, exist_ok=True)
+    missing = [record for record in records if not _is_cached(record, pkgs_dir)]
+    if not missing:
+        return 0
+    with ThreadPoolExecutor(max(1, min(workers, len(missing)))) as pool:
+        done = list(pool.map(lambda record: _download(record, pkgs_dir), missing))
+    downloaded = [record for record, downloaded in zip(missing, done) if downloaded]
+    with FileLock(str(lock_path(str(pkgs_dir / "urls.txt")))):
+        with open(pkgs_dir / "urls.txt", "a") as urls:
+            urls.writelines(f"{record['url']}\n" for record in downloaded)
+    return len(downloaded)
+
+
+def _filename(record: Dict[str, Any]) -> str:
+    return record["url"].rsplit("/", 1)[-1]
+
+
+def _is_cached(record: Dict[str, Any], pkgs_dir: Path) -> bool:
+    filename = _filename(record)
+    extracted = pkgs_dir / re.sub(r"(\.tar\.bz2|\.conda)$", "", filename)
+    if (extracted / "info" / "index.json").exists():
+        return True
+    tarball = pkgs_dir / filename
+    return tarball.exists() and _verify(record, tarball) is None
+
+
+def _download(record: Dict[str, Any], pkgs_dir: Path) -> bool:
+    """Download a package unless another process did so while waiting for its lock."""
+    target = pkgs_dir / _filename(record)
+    with FileLock(str(lock_path(str(target)))):
+        if _is_cached(record, pkgs_dir):
+            return False
+        _fetch(record, target)
+    return True
+
+
+def _fetch(record: Dict[str, Any], target: Path) -> None:
+    url = record["url"]
+    partial = target.with_name(f"{target.name}.partial")
+    offset = partial.stat().st_size if partial.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    try:
+        with urlopen(Request(url, headers=headers), timeout=_TIMEOUT) as response:
+            # Servers that ignore the range send the whole file again.
+            resumed = offset > 0 and getattr(response, "status", None) == 206
+            with open(partial, "ab" if resumed else "wb") as file:
+                shutil.copyfileobj(response, file, _CHUNK_SIZE)
+    except HTTPError as exception:
+        if not (exception.code == 416 and offset):  # the partial file is already complete
+            raise Fail(f"failed to download {url}: {exception}")
+    except (URLError, OSError) as exception:
+        raise Fail(f"failed to download {url}: {exception}")
+
+    mismatch = _verify(record, partial)
+    if mismatch is not None:
+        partial.unlink()
+        raise Fail(f"failed to download {url}: {mismatch}")
+    os.replace(partial, target)
+
+
+def _verify(record: Dict[str, Any], path: Path) -> Optional[str]:
+    """Return why `path` does not match the checksum of `record`, None if it does."""
+    algorithm = "sha256" if record.get("sha256") else "md5" if record.get("md5") else None
+    if algorithm is None:
+        return None
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != record[algorithm]:
+        return f"{algorithm} is {digest.hexdigest()}, expected {record[algorithm]}"
+    return None
@@ -0,0 +1,116 @@
+"""Content hashes of conda spec and environment files, including the files they reference."""
+
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ruamel.yaml import YAML, YAMLError
+
+from tox_conda.cache import JsonCache, cache_dir
+
+__all__ = []
+
+_CHUNK_SIZE = 1024 * 1024
+
+# `-r other.txt`, `--requirement=other.txt`, `-c constraints.txt`, ... in requirement files and
+# in the pip section of environment files
+_REFERENCE = re.compile(
+    r"^\s*(?:-[rc]\s*|--(?:requirement|constraint)(?:\s*=\s*|\s+))(?P<path>[^\s#]+)"
+)
+
+# (path, mtime, size) -> (digest, references) of the files hashed by this process
+_MEMO: Dict[Tuple[str, int, int], Tuple[str, List[str]]] = {}
+
+
+def hash_closure(path: Path, files: Optional[List[Path]] = None) -> str:
+    """Hash a spec or environment file together with every file it references, transitively.
+
+    The digest only depends on the content of the files and on the references as written,
+    not on where the files live, and it changes when a referenced file is created or removed.
+    The paths of all hashed files, including missing ones, are appended to `files` if given.
+    """
+    return _hash_node(Path(path).resolve(), set(), [] if files is None else files)
+
+
+def _hash_node(path: Path, parents: Set[Path], files: List[Path]) -> str:
+    node = hashlib.blake2b(digest_size=20)
+    files.append(path)
+    scanned = _scan(path)
+    if scanned is None:
+        node.update(b"missing")
+        return node.hexdigest()
+    digest, references = scanned
+    node.update(digest.encode())
+    parents = parents | {path}
+    for reference in references:
+        node.update(f"\0{reference}\0".encode())
+        if "://" in reference:
+            continue  # remote files are not followed
+        target = (path.parent / os.path.expanduser(reference)).resolve()
+        if target in parents:
+            node.update(b"cycle")
+        else:
+            node.update(_hash_node(target, parents, files).encode())
+    return node.hexdigest()
+
+
+def _scan(path: Path) -> Optional[Tuple[str, List[str]]]:
+    """Return the digest and the references of a file, reading it only when it changed."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    stat_key = [stat.st_mtime_ns, stat.st_size]
+    key = (str(path), *stat_key)
+    if key in _MEMO:
+        return _MEMO[key]
+
+    disk_memo = JsonCache(cache_dir() / "hashes.json")
+    cached = disk_memo.get(key[0])
+    if cached is not None and cached["stat"] == stat_key:
+        result = cached["digest"], cached["references"]
+    else:
+        try:
+            result = _digest(path), _references(path)
+        except OSError:
+            return None
+        disk_memo.set(key[0], {"stat": stat_key, "digest": result[0], "references": result[1]})
+    _MEMO[key] = result
+    return result
+
+
+def _digest(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _references(path: Path) -> List[str]:
+    if path.suffix in (".yml", ".yaml"):
+        try:
+            lines = _pip_requirements(YAML(typ="safe").load(path))
+        except YAMLError:
+            lines = []  # conda reports the broken file when it reads it
+    else:
+        with open(path, encoding="utf-8", errors="replace") as file:
+            lines = list(file)
+    references = []
+    for line in lines:
+        match = _REFERENCE.match(line)
+        if match is not None:
+            references.append(match.group("path"))
+    return references
+
+
+def _pip_requirements(env_file: Any) -> List[str]:
+    """Return the entries of the pip sections of a conda environment file."""
+    dependencies = env_file.get("dependencies") if isinstance(env_file, dict) else None
+    requirements = []
+    for dependency in dependencies or []:
+        if isinstance(dependency, dict) and isinstance(dependency.get("pip"), list):
+            requirements.extend(str(requirement) for requirement in dependency["pip"])
+    return requirements
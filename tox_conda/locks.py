@@ -0,0 +1,41 @@
+"""Coordination of conda operations between the environments of parallel tox runs."""
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from filelock import FileLock, Timeout
+
+from tox_conda.cache import lock_path
+
+__all__ = []
+
+_POLL_INTERVAL = 0.05
+
+
+@contextmanager
+def transaction_slot(limit: int) -> Iterator[float]:
+    """Hold one of `limit` slots shared by all tox processes of the user.
+
+    The slots are file locks, so processes that crash release their slot. A `limit` of zero or
+    less does not limit anything.
+
+    :return: the seconds waited for a free slot
+    """
+    start = time.monotonic()
+    if limit <= 0:
+        yield 0.0
+        return
+    locks = [FileLock(str(lock_path(f"transaction-{slot}"))) for slot in range(limit)]
+    while True:
+        for lock in locks:
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                continue
+            try:
+                yield time.monotonic() - start
+            finally:
+                lock.release()
+            return
+        time.sleep(_POLL_INTERVAL)
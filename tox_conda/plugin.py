@@ -1,15 +1,22 @@
 import os
 from functools import partial
-from typing import TYPE_CHECKING, List
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
 
+from tox.config.cli.parser import CORE
 from tox.plugin import impl
+from tox.session.cmd.run.common import env_run_create_flags
+from tox.session.env_select import CliEnv, register_env_select_flags
 from tox.tox_env.errors import Fail
 from tox.tox_env.python.pip.req_file import PythonDeps
 
+from . import prepare, store, timing
 from .conda import CondaEnvRunner, find_conda
+from .prefetch import conda_order, conda_prefetch
 
 if TYPE_CHECKING:
-    from tox.config.sets import EnvConfigSet
+    from tox.config.cli.parser import ToxParser
+    from tox.config.sets import ConfigSet, EnvConfigSet
     from tox.session.state import State
     from tox.tox_env.register import ToxEnvRegister
 
@@ -28,6 +35,81 @@ def tox_register_tox_env(register: "ToxEnvRegister") -> None:  # noqa: U100
         pass
 
 
+@impl
+def tox_add_option(parser: "ToxParser") -> None:
+    parser.add_argument(
+        "--conda-offline",
+        action="store_true",
+        default=False,
+        help="create and update conda environments only from the local package cache",
+    )
+    parser.add_argument(
+        "--conda-trace",
+        type=Path,
+        of_type=Optional[Path],
+        default=None,
+        metavar="PATH",
+        help="write the phases and commands of the conda environments to PATH as a Chrome "
+        "trace, with a track per environment",
+    )
+    prefetch = parser.add_command(
+        "conda-prefetch",
+        [],
+        "download the conda packages of the selected environments into the package cache",
+        conda_prefetch,
+        inherit=frozenset({CORE}),
+    )
+    register_env_select_flags(prefetch, default=CliEnv())
+    env_run_create_flags(prefetch, mode="config")
+    order = parser.add_command(
+        "conda-order",
+        [],
+        "print the selected environments, the longest running one first, as recorded by "
+        "earlier runs",
+        conda_order,
+        inherit=frozenset({CORE}),
+    )
+    register_env_select_flags(order, default=CliEnv())
+
+
+@impl
+def tox_add_core_config(core_conf: "ConfigSet", state: "State") -> None:  # noqa: U100
+    core_conf.add_config(
+        "conda_store_budget",
+        of_type=str,
+        desc="disk budget (e.g. 20G) for the environments and lock files tox-conda keeps in its "
+        "shared cache directory, checked when a tox run starts and before adding to it; least "
+        "recently used ones are evicted when exceeded. Only space that evicting would free "
+        "counts, not the package files that environments hard-link from the package cache",
+        default=None,
+    )
+    core_conf.add_config(
+        "conda_repodata_ttl",
+        of_type=int,
+        desc="seconds for which the repodata revalidated by an earlier tox run is used without "
+        "revalidating it; within one tox run only the first conda command revalidates it",
+        default=0,
+    )
+    core_conf.add_config(
+        "conda_max_transactions",
+        of_type=int,
+        desc="maximum number of conda commands that solve or link packages at the same time, "
+        "across all tox processes of the user; 0 for no limit",
+        default=0,
+    )
+    core_conf.add_config(
+        "conda_prepare_workers",
+        of_type=int,
+        desc="solve the selected conda environments that do not exist yet and download their "
+        "packages with this many background threads while earlier environments run, in "
+        "sequential runs only; 0 prepares nothing",
+        default=0,
+    )
+    prepare.start_session(state)
+    store.start_session()
+    timing.start_session()
+
+
 @impl
 def tox_add_env_config(env_conf: "EnvConfigSet", state: "State") -> None:
     env_conf.add_config(
@@ -89,3 +171,77 @@ def tox_add_env_config(env_conf: "EnvConfigSet", state: "State") -> None:
         desc="each line specifies a conda create argument",
         default=None,
     )
+
+    env_conf.add_config(
+        "conda_backend",
+        of_type=str,
+        desc="package manager that creates the conda environment: 'conda' uses the conda "
+        "compatible executable that is found (conda, mamba or micromamba), 'micromamba' always "
+        "uses micromamba",
+        default="conda",
+    )
+
+    env_conf.add_config(
+        "conda_root_prefix",
+        of_type=str,
+        desc="root prefix of micromamba, which holds its package cache and named environments; "
+        "MAMBA_ROOT_PREFIX by default",
+        default=None,
+    )
+
+    env_conf.add_config(
+        "conda_solver",
+        of_type=str,
+        desc="solver used to create and update the environment: 'libmamba' or 'classic'; by "
+        "default the solver configured for conda is used",
+        default=None,
+    )
+
+    env_conf.add_config(
+        "conda_offline",
+        of_type=bool,
+        desc="create and update the environment only from the local package cache, failing "
+        "with the list of missing packages instead of downloading them",
+        default=False,
+    )
+
+    env_conf.add_config(
+        "conda_download_workers",
+        of_type=int,
+        desc="download the packages of a new environment with this many threads before conda "
+        "creates it; 0 leaves the downloads to conda",
+        default=0,
+    )
+
+    env_conf.add_config(
+        "conda_executor",
+        of_type=str,
+        desc="how commands are run in the conda environment: 'conda-run' wraps every command "
+        "in 'conda run', 'direct' computes the activated environment once and runs commands "
+        "directly with it",
+        default="conda-run",
+    )
+
+    env_conf.add_config(
+        "conda_solve_once",
+        of_type=bool,
+        desc="create the environment with python, conda_deps, conda_channels and conda_spec in "
+        "a single 'conda create' instead of a 'conda create' followed by a 'conda install'",
+        default=False,
+    )
+
+    env_conf.add_config(
+        "conda_lock",
+        of_type=bool,
+        desc="record the solved environment as an explicit lock file and recreate identical "
+        "environments from it without running the solver",
+        default=False,
+    )
+
+    env_conf.add_config(
+        "conda_store",
+        of_type=bool,
+        desc="keep a template of the created environment in the shared cache directory and "
+        "clone environments with the same conda settings from it instead of solving them",
+        default=False,
+    )
@@ -0,0 +1,96 @@
+"""The ``tox conda-prefetch`` and ``tox conda-order`` commands, which prepare parallel runs."""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from tox.tox_env.errors import Fail
+
+from tox_conda.conda import CondaEnvRunner
+from tox_conda.costs import CostDb, by_cost
+
+if TYPE_CHECKING:
+    from tox.session.state import State
+
+__all__ = []
+
+
+def conda_prefetch(state: "State") -> int:
+    """Download the union of the packages the selected conda environments need.
+
+    Every environment is solved without being created, in parallel, and the packages that are
+    not in the package cache yet are downloaded in parallel, once per package cache, so a
+    following ``tox run`` only links packages. The environments that took longest to provision
+    in earlier runs are solved first. Environments created from ``conda_env`` are skipped.
+    """
+    cost_db = CostDb(state.conf.core["work_dir"])
+    runners = []
+    names = by_cost(list(state.envs.iter()), partial(cost_db.estimate, provisioned=False))
+    for name in names:
+        tox_env = state.envs[name]
+        if not isinstance(tox_env, CondaEnvRunner):
+            logging.warning("%s: skipped, it is not a conda environment", name)
+        elif tox_env.conf["conda_env"]:
+            logging.warning("%s: skipped, conda_env environments cannot be solved ahead", name)
+        else:
+            runners.append(tox_env)
+    if not runners:
+        return 0
+
+    failed: List[str] = []
+
+    def solve(runner: CondaEnvRunner) -> List[Dict[str, Any]]:
+        try:
+            return runner.solve_downloads()
+        except Fail as exception:
+            logging.error("%s: %s", runner.name, exception)
+            failed.append(runner.name)
+            return []
+
+    with ThreadPoolExecutor(min(len(runners), os.cpu_count() or 1)) as pool:
+        solved = list(pool.map(solve, runners))
+    for runner in runners:
+        runner.record_run()
+
+    # The same package may be solved for several environments, download it only once.
+    downloads: Dict[Tuple[Path, ...], Tuple[CondaEnvRunner, Dict[str, Dict[str, Any]]]] = {}
+    for runner, records in zip(runners, solved):
+        pkgs_dirs = tuple(runner.backend.pkgs_dirs())
+        _, by_url = downloads.setdefault(pkgs_dirs, (runner, {}))
+        for record in records:
+            by_url.setdefault(record["url"], record)
+
+    for runner, by_url in downloads.values():
+        if not by_url:
+            continue
+        try:
+            downloaded = runner.download_packages(list(by_url.values()))
+        except Fail as exception:
+            logging.error("%s", exception)
+            return 1
+        logging.warning("downloaded %d of %d packages", downloaded, len(by_url))
+    return 1 if failed else 0
+
+
+def conda_order(state: "State") -> int:
+    """Print the selected environments, the most expensive one first, for ``tox -p -e``.
+
+    tox starts parallel environments in the order they are selected in. Environments that exist
+    already are only expected to run their commands.
+    """
+    cost_db = CostDb(state.conf.core["work_dir"])
+
+    def estimate(name: str) -> Optional[float]:
+        tox_env = state.envs[name]
+        provisioned = not isinstance(tox_env, CondaEnvRunner) or Path(tox_env.env_dir).exists()
+        return cost_db.estimate(name, provisioned)
+
+    names = by_cost(list(state.envs.iter()), estimate)
+    for name in names:
+        seconds = estimate(name)
+        logging.info("%s: %s", name, "never ran" if seconds is None else f"{seconds:.1f}s")
+    print(",".join(names))  # noqa: T201
+    return 0
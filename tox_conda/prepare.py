@@ -0,0 +1,105 @@
+"""Solving and downloading conda environments in the background, before tox reaches them."""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional
+
+from tox.tox_env.errors import Fail
+
+from tox_conda.costs import CostDb, by_cost
+
+if TYPE_CHECKING:
+    from tox.session.state import State
+
+    from tox_conda.conda import CondaEnvRunner
+
+__all__ = []
+
+
+class Preparer:
+    """Prepares the conda environments of one tox session in a pool of background threads.
+
+    Preparing an environment solves it and downloads its packages into the package cache, but
+    does not link anything. conda cannot link the result of a dry run, so creating the
+    environment solves it again, with the repodata and all packages already on disk.
+    """
+
+    def __init__(self, state: "State") -> None:
+        self.state = state
+        self._started = False
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def start(self, current: "CondaEnvRunner") -> None:
+        """Prepare the selected conda environments after `current` that do not exist yet.
+
+        Environments that will be created from the store are not prepared, and the most
+        expensive ones are submitted first. Only the first call of a sequential session starts
+        anything; parallel runs create their environments concurrently already.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            workers = current.core["conda_prepare_workers"]
+            if workers <= 0 or getattr(self.state.conf.options, "parallel", 0):
+                return
+            runners = self._runners(current)
+            if not runners:
+                return
+            cost_db = CostDb(current.core["work_dir"])
+            names = by_cost(list(runners), partial(cost_db.estimate, provisioned=False))
+            pool = ThreadPoolExecutor(min(workers, len(runners)), thread_name_prefix="tox-conda")
+            for name in names:
+                self._futures[name] = pool.submit(runners[name].prepare)
+            pool.shutdown(wait=False)
+
+    def _runners(self, current: "CondaEnvRunner") -> Dict[str, "CondaEnvRunner"]:
+        from tox_conda.conda import CondaEnvRunner
+
+        runners = {}
+        for name in self.state.envs.iter():
+            tox_env = self.state.envs[name]
+            if tox_env is current or not isinstance(tox_env, CondaEnvRunner):
+                continue
+            if tox_env.conf["conda_env"] or Path(tox_env.env_dir).exists():
+                continue
+            try:
+                if tox_env.reuses_store():
+                    continue
+            except Fail:  # e.g. a missing spec file, reported when the environment is created
+                continue
+            runners[name] = tox_env
+        return runners
+
+    def wait(self, name: str) -> bool:
+        """Wait until the environment is prepared, if it is being prepared.
+
+        :return: whether the environment was prepared
+        """
+        with self._lock:
+            future = self._futures.pop(name, None)
+        if future is None or future.cancel():  # not started yet, creating solves just as well
+            return False
+        try:
+            future.result()
+        except Exception as exception:  # creating the environment reports real problems
+            logging.info("%s: preparing the environment failed: %s", name, exception)
+            return False
+        return True
+
+
+_PREPARER: Optional[Preparer] = None
+
+
+def start_session(state: "State") -> None:
+    """Forget the preparations of an earlier session of the same process."""
+    global _PREPARER
+    _PREPARER = Preparer(state)
+
+
+def preparer() -> Optional[Preparer]:
+    return _PREPARER
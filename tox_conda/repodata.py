@@ -0,0 +1,42 @@
+"""When conda may solve with the repodata it already has instead of revalidating it."""
+
+import json
+import threading
+import time
+from typing import Dict, List
+
+from tox_conda.cache import JsonCache, cache_dir
+
+__all__ = []
+
+# key -> time the repodata was refreshed by this tox process
+_REFRESHED: Dict[str, float] = {}
+_REFRESHED_LOCK = threading.Lock()
+
+
+def repodata_key(exe: str, channels: List[str]) -> str:
+    """Key of the repodata a frontend reads for a list of channels."""
+    return json.dumps([exe, channels])
+
+
+def use_index_cache(key: str, ttl: int) -> bool:
+    """Whether the repodata of `key` is fresh enough to be used without revalidating it.
+
+    Repodata refreshed by this tox process is always fresh. Repodata refreshed by an earlier
+    tox run is fresh for `ttl` seconds.
+    """
+    with _REFRESHED_LOCK:
+        if key in _REFRESHED:
+            return True
+    if ttl <= 0:
+        return False
+    refreshed = JsonCache(cache_dir() / "repodata.json").get(key)
+    return refreshed is not None and time.time() - refreshed < ttl
+
+
+def mark_refreshed(key: str) -> None:
+    """Record that a command revalidated the repodata of `key`."""
+    now = time.time()
+    with _REFRESHED_LOCK:
+        _REFRESHED[key] = now
+    JsonCache(cache_dir() / "repodata.json").set(key, now)
@@ -0,0 +1,264 @@
+"""Artifacts tox-conda keeps between tox runs to provision conda environments faster."""
+
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from filelock import FileLock, Timeout
+
+from tox_conda.cache import cache_dir, lock_path, write_json
+
+__all__ = []
+
+# Keys of the conda section of `python_cache()` that only describe where an environment lives,
+# not what is installed into it.
+LOCATION_KEYS = ("env_spec", "env", "env_path", "spec")
+
+
+# Whether the disk budget was checked in the current tox session
+_BUDGET_CHECKED = False
+_BUDGET_LOCK = threading.Lock()
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value: str) -> int:
+    """Parse a disk size such as ``500M`` or ``20G`` (binary units) into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", value, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"invalid size {value!r}, expected e.g. 500M or 20G")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(size: int) -> str:
+    for unit in ("", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if not unit else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def start_session() -> None:
+    """Check the disk budget again in the next tox session of the process."""
+    global _BUDGET_CHECKED
+    with _BUDGET_LOCK:
+        _BUDGET_CHECKED = False
+
+
+def claim_budget_check() -> bool:
+    """Return True for the first environment of a tox session, which checks the disk budget."""
+    global _BUDGET_CHECKED
+    with _BUDGET_LOCK:
+        claimed, _BUDGET_CHECKED = not _BUDGET_CHECKED, True
+    return claimed
+
+
+def store_key(conda_cache_conf: Dict[str, Any], python_packages: str) -> str:
+    """Digest identifying the content of a conda environment, independent of its location."""
+    content = {key: value for key, value in conda_cache_conf.items() if key not in LOCATION_KEYS}
+    content["python"] = python_packages
+    content["platform"] = [sys.platform, platform.machine()]
+    serialized = json.dumps(content, sort_keys=True).encode()
+    return hashlib.sha256(serialized).hexdigest()[:32]
+
+
+class StoreEntry(NamedTuple):
+    """A template environment or a lock file in the store."""
+
+    kind: str
+    key: str
+    path: Path
+    last_used: float
+
+
+class StoreEntryUsage(NamedTuple):
+    entry: StoreEntry
+    #: bytes only this entry holds, i.e. freed when it is evicted
+    size: int
+
+
+class Store:
+    """The shared directory holding explicit lock files and template environments.
+
+    Template environments are complete conda environments, one per content key. They are
+    never used directly: tox environments with the same key are cloned from them. Saving,
+    cloning, touching and removing the entries of a key happen under `entry_lock`.
+    """
+
+    def __init__(self, root: Optional[Path] = None) -> None:
+        self.root = Path(root) if root is not None else cache_dir()
+
+    @staticmethod
+    def entry_lock(key: str) -> FileLock:
+        """Lock of the entries of `key`, shared by the threads and processes using the store."""
+        return FileLock(str(lock_path(f"store-{key}")))
+
+    def lock_path(self, key: str) -> Path:
+        return self.root / "explicit" / f"{key}.txt"
+
+    def write_lock(self, key: str, content: str) -> Path:
+        path = self.lock_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        with open(fd, "w") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_name, path)
+        return path
+
+    def env_path(self, key: str) -> Path:
+        return self.root / "envs" / key
+
+    def _env_marker(self, key: str) -> Path:
+        # Kept next to the template, files inside it would be copied by every clone
+        return self.root / "envs" / f"{key}.json"
+
+    def has_env(self, key: str) -> bool:
+        """Whether a complete template environment exists for `key`."""
+        return self._env_marker(key).is_file() and self.env_path(key).is_dir()
+
+    def prepare_env(self, key: str) -> Path:
+        """Discard leftovers of an incomplete template and return the path to create it at."""
+        path = self.env_path(key)
+        self._env_marker(key).unlink(missing_ok=True)
+        if path.exists():
+            shutil.rmtree(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def mark_env(self, key: str) -> None:
+        """Record that the template environment for `key` is complete."""
+        write_json(self._env_marker(key), {"key": key, "created": time.time()})
+
+    def touch_env(self, key: str) -> None:
+        """Record that the template environment for `key` was used."""
+        marker = self._env_marker(key)
+        content = json.loads(marker.read_text())
+        content["last_used"] = time.time()
+        write_json(marker, content)
+
+    def touch_lock(self, key: str) -> None:
+        """Record that the lock file for `key` was used, its modification time is the last use."""
+        os.utime(self.lock_path(key))
+
+    def entries(self) -> List[StoreEntry]:
+        """All complete entries of the store, least recently used first."""
+        entries = []
+        for marker in (self.root / "envs").glob("*.json"):
+            # entries may be evicted by another process while they are listed
+            try:
+                content = json.loads(marker.read_text())
+                last_used = content.get("last_used", content["created"])
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append(StoreEntry("env", marker.stem, marker.with_suffix(""), last_used))
+        for lock in (self.root / "explicit").glob("*.txt"):
+            try:
+                last_used = lock.stat().st_mtime
+            except OSError:
+                continue
+            entries.append(StoreEntry("lock", lock.stem, lock, last_used))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def _inodes(self, entries: List[StoreEntry]) -> Dict[Tuple[int, int], List[Any]]:
+        """Map the inodes of the entries to their size and the entries linking them.
+
+        Inodes that are also linked from outside the store, e.g. the package files conda
+        hard-links from its package cache, are left out: evicting entries does not free them.
+        """
+        inodes: Dict[Tuple[int, int], List[Any]] = {}
+        for entry in entries:
+            for stat in _walk_stats(entry.path):
+                inode = inodes.get((stat.st_dev, stat.st_ino))
+                if inode is None:
+                    inode = inodes[(stat.st_dev, stat.st_ino)] = [_disk_size(stat), stat.st_nlink]
+                inode.append(entry)
+        # after the size and the link count, one item per link found in the store
+        return {key: inode for key, inode in inodes.items() if len(inode) - 2 >= inode[1]}
+
+    def usage(self) -> Tuple[int, List[StoreEntryUsage]]:
+        """Compute the disk space held by the store and by each of its entries.
+
+        Every file is counted once per inode, no matter how many entries hard-link it.
+
+        :return: the bytes held by the whole store, and the usage of every entry, least
+            recently used first
+        """
+        entries = self.entries()
+        total = 0
+        exclusive: Dict[StoreEntry, int] = {entry: 0 for entry in entries}
+        for size, _, *holders in self._inodes(entries).values():
+            total += size
+            if len(set(holders)) == 1:
+                exclusive[holders[0]] += size
+        return total, [StoreEntryUsage(entry, exclusive[entry]) for entry in entries]
+
+    def remove(self, entry: StoreEntry) -> None:
+        with self.entry_lock(entry.key):
+            self._remove(entry)
+
+    def _remove(self, entry: StoreEntry) -> None:
+        if entry.kind == "env":
+            self._env_marker(entry.key).unlink(missing_ok=True)
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            entry.path.unlink(missing_ok=True)
+
+    def evict(self, budget: int) -> List[StoreEntry]:
+        """Remove least recently used entries until the store holds at most `budget` bytes.
+
+        :return: the evicted entries
+        """
+        entries = self.entries()
+        inodes = self._inodes(entries)
+        total = sum(inode[0] for inode in inodes.values())
+        held: Dict[StoreEntry, List[List[Any]]] = {entry: [] for entry in entries}
+        for inode in inodes.values():
+            for holder in set(inode[2:]):
+                held[holder].append(inode)
+
+        evicted: List[StoreEntry] = []
+        for entry in entries:
+            if total <= budget:
+                break
+            lock = self.entry_lock(entry.key)
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                continue  # a tox environment is cloning or saving it right now
+            try:
+                self._remove(entry)
+            finally:
+                lock.release()
+            evicted.append(entry)
+            # space shared between entries is only freed once all of them are gone
+            for inode in held[entry]:
+                if all(holder in evicted for holder in inode[2:]):
+                    total -= inode[0]
+        return evicted
+
+
+def _walk_stats(path: Path) -> Iterator[os.stat_result]:
+    """Stat every file and symlink in `path`, without following symlinks."""
+    if not path.is_dir():
+        yield path.lstat()
+        return
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            yield os.lstat(os.path.join(root, name))
+        for name in dirs:
+            if os.path.islink(os.path.join(root, name)):
+                yield os.lstat(os.path.join(root, name))
+
+
+def _disk_size(stat: os.stat_result) -> int:
+    blocks = getattr(stat, "st_blocks", None)
+    return blocks * 512 if blocks is not None else stat.st_size
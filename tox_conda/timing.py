@@ -0,0 +1,221 @@
+"""Resource usage of the commands conda environments run, reported once per tox session."""
+
+import inspect
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Optional, Sequence, Type
+
+from tox.execute.api import ExecuteInstance, ExecuteStatus
+
+from tox_conda.cache import write_json
+from tox_conda.costs import cost_phase
+
+__all__ = []
+
+CommandRecord = Dict[str, Any]
+
+
+class TimedExecuteInstance(ExecuteInstance):
+    """Wraps the execution of a command to record its duration and resource usage.
+
+    CPU time and peak RSS come from the rusage of the child process, which is only available
+    on POSIX, for processes started by tox; they are None otherwise.
+    """
+
+    def __init__(
+        self, instance: ExecuteInstance, on_done: Callable[[CommandRecord], None]
+    ) -> None:
+        super().__init__(instance.request, instance.options, instance._out, instance._err)
+        self._instance = instance
+        self._on_done = on_done
+        self._status: Optional[ExecuteStatus] = None
+        self._rusage: Dict[str, Any] = {}
+        self._start = 0.0
+        self._start_monotonic = 0.0
+
+    def __enter__(self) -> ExecuteStatus:
+        self._start, self._start_monotonic = time.time(), time.monotonic()
+        self._status = self._instance.__enter__()
+        process = getattr(self._instance, "process", None)
+        if process is not None:
+            _track_rusage(process, self._rusage)
+        return self._status
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        try:
+            self._instance.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._on_done(self._record())
+
+    @property
+    def cmd(self) -> Sequence[str]:
+        return self._instance.cmd
+
+    def _record(self) -> CommandRecord:
+        status = self._status
+        rusage = self._rusage.get("rusage")
+        return {
+            "run_id": self.request.run_id,
+            "argv": [str(arg) for arg in self.cmd],
+            "start": round(self._start, 3),
+            "wall": round(time.monotonic() - self._start_monotonic, 3),
+            "cpu": round(rusage.ru_utime + rusage.ru_stime, 3) if rusage else None,
+            "max_rss": _max_rss_bytes(rusage.ru_maxrss) if rusage else None,
+            "exit_code": status.exit_code if status is not None else None,
+            "stdout_bytes": len(status.out) if status is not None else 0,
+            "stderr_bytes": len(status.err) if status is not None else 0,
+        }
+
+
+def _track_rusage(process: Any, holder: Dict[str, Any]) -> None:
+    """Make a `subprocess.Popen` keep the rusage of its child when it reaps it.
+
+    Popen reaps its child with ``waitpid``, which discards the rusage, so both of its internal
+    reaping paths are redirected to ``wait4``. They are private, so a Popen that does not have
+    them in the expected shape is left alone and no rusage is recorded.
+    """
+    if not hasattr(os, "wait4") or not _has_reaping_hooks(type(process)):
+        return
+
+    def wait4(pid: int, options: int):
+        reaped, status, rusage = os.wait4(pid, options)
+        if reaped == pid:
+            holder["rusage"] = rusage
+        return reaped, status
+
+    def try_wait(wait_flags: int):
+        try:
+            return wait4(process.pid, wait_flags)
+        except ChildProcessError:  # reaped elsewhere, e.g. by a SIGCHLD handler
+            return process.pid, 0
+
+    internal_poll = type(process)._internal_poll
+    process._try_wait = try_wait
+    process._internal_poll = lambda *args, **kwargs: internal_poll(
+        process, *args, _waitpid=wait4, **kwargs
+    )
+
+
+def _has_reaping_hooks(popen_type: type) -> bool:
+    try:
+        try_wait = inspect.signature(popen_type._try_wait)
+        internal_poll = inspect.signature(popen_type._internal_poll)
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return list(try_wait.parameters) == ["self", "wait_flags"] and (
+        "_waitpid" in internal_poll.parameters
+    )
+
+
+def _max_rss_bytes(max_rss: int) -> int:
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class SessionReport:
+    """The commands the conda environments of one tox session ran."""
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._envs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self, path: Path, env_name: str, report: Dict[str, Any], trace: Optional[Path] = None
+    ) -> None:
+        """Add the report of an environment and rewrite the report files of the session.
+
+        :param trace: where to also write the session as a Chrome trace, if anywhere
+        """
+        with self._lock:
+            self._envs[env_name] = report
+            write_json(path, {"started": round(self.started, 3), "envs": self._envs})
+            if trace is not None:
+                write_json(Path(trace), chrome_trace(self.started, self._envs))
+
+
+def chrome_trace(started: float, envs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert the reports of environments to the Chrome Trace Event format.
+
+    Every environment is a track of complete events, one per phase that ran no command (e.g.
+    discovery, downloads or waiting for a transaction slot) and one per command, categorized by
+    its phase. The file opens in ``chrome://tracing`` and https://ui.perfetto.dev.
+    """
+    pid = os.getpid()
+    events: List[Dict[str, Any]] = []
+    for tid, (env_name, report) in enumerate(envs.items(), start=1):
+        events.append(
+            {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": env_name}}
+        )
+        events.append(
+            {
+                "ph": "M",
+                "name": "thread_sort_index",
+                "pid": pid,
+                "tid": tid,
+                "args": {"sort_index": tid},
+            }
+        )
+        for span in report.get("spans", []):
+            events.append(_complete_event(span, span["name"], {}, started, pid, tid))
+        for command in report.get("commands", []):
+            args = {key: command[key] for key in ("argv", "exit_code", "cpu", "max_rss")}
+            category = _command_category(command["run_id"])
+            events.append(
+                _complete_event(command, command["run_id"], args, started, pid, tid, category)
+            )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _complete_event(
+    record: Dict[str, Any],
+    name: str,
+    args: Dict[str, Any],
+    started: float,
+    pid: int,
+    tid: int,
+    category: Optional[str] = None,
+) -> Dict[str, Any]:
+    return {
+        "ph": "X",
+        "name": name,
+        "cat": category or name,
+        # microseconds since the start of the session
+        "ts": round((record["start"] - started) * 1e6),
+        "dur": round(record["wall"] * 1e6),
+        "pid": pid,
+        "tid": tid,
+        "args": args,
+    }
+
+
+def _command_category(run_id: str) -> str:
+    phase = cost_phase(run_id)
+    if phase is not None:
+        return phase
+    return "python probe" if run_id == "_get_python" else "introspection"
+
+
+_REPORT: Optional[SessionReport] = None
+
+
+def start_session() -> None:
+    """Start a new report, so a process running several sessions reports each one separately."""
+    global _REPORT
+    _REPORT = SessionReport()
+
+
+def session_report() -> SessionReport:
+    global _REPORT
+    if _REPORT is None:
+        _REPORT = SessionReport()
+    return _REPORT